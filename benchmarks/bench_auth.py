@@ -0,0 +1,97 @@
+import argparse
+import os
+
+parser = argparse.ArgumentParser(description="Token verification throughput against a local stand-in Keycloak with injected latency")
+parser.add_argument('--requests', type=int, default=200, help="number of authenticated requests per run")
+parser.add_argument('--tokens', type=int, default=20, help="number of distinct tokens (users) sending the requests")
+parser.add_argument('--latency', type=float, default=0.02, help="latency (in seconds) of every call to the IdP")
+args = parser.parse_args()
+
+import asyncio  # noqa: E402
+import base64  # noqa: E402
+import json  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: E402
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from jose import jwt  # noqa: E402
+
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PRIVATE_PEM = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+PUBLIC_KEY = base64.b64encode(
+    private_key.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+).decode('ascii')
+
+
+# the realm page of Keycloak (GET /realms/<realm>), which is where python-keycloak reads the public key from
+class IdpHandler(BaseHTTPRequestHandler):
+    fetches = 0
+
+    def do_GET(self):
+        IdpHandler.fetches += 1
+        time.sleep(args.latency)
+        body = json.dumps({'realm': 'benchmark', 'public_key': PUBLIC_KEY}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+idp = ThreadingHTTPServer(('127.0.0.1', 0), IdpHandler)
+threading.Thread(target=idp.serve_forever, daemon=True).start()
+os.environ['KEYCLOAK_SERVER_URL'] = f"http://127.0.0.1:{idp.server_port}/"
+
+import common  # noqa: E402,F401
+from starlette.concurrency import run_in_threadpool  # noqa: E402
+from authentication import auth  # noqa: E402
+
+
+def reset():
+    auth._public_key.update(value=None, fetched_at=0.0)
+    auth._verified_tokens.clear()
+    IdpHandler.fetches = 0
+
+
+# what every request did before the caches: fetch the key from the IdP, then verify the signature
+async def uncached(token):
+    public_key = await run_in_threadpool(auth.keycloak_openid.public_key)
+    return auth.decode_token(token, f"-----BEGIN PUBLIC KEY-----\n{public_key}\n-----END PUBLIC KEY-----")
+
+
+async def key_cache_only(token):
+    auth._verified_tokens.clear()
+    return await auth.get_payload(token)
+
+
+async def run(verify, tokens):
+    reset()
+    start = time.perf_counter()
+    for i in range(args.requests):
+        await verify(tokens[i % len(tokens)])
+    return args.requests / (time.perf_counter() - start), IdpHandler.fetches
+
+
+async def main():
+    tokens = [
+        jwt.encode({'sub': str(i), 'aud': 'provenance-api', 'exp': int(time.time()) + 3600}, PRIVATE_PEM, algorithm='RS256')
+        for i in range(args.tokens)
+    ]
+    print(f"{args.requests} requests from {args.tokens} tokens, {args.latency * 1000:.0f} ms per IdP call")
+    print(f"{'verification':>28} {'requests/s':>11} {'IdP calls':>10}")
+    for name, verify in (
+        ('fetch key on every request', uncached),
+        ('cached key', key_cache_only),
+        ('cached key and tokens', auth.get_payload),
+    ):
+        throughput, fetches = await run(verify, tokens)
+        print(f"{name:>28} {throughput:>11.1f} {fetches:>10}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
+    idp.shutdown()
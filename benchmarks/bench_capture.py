@@ -0,0 +1,61 @@
+import argparse
+
+parser = argparse.ArgumentParser(description="Provenance capture time (build_provenance) for generated workflows of increasing size")
+parser.add_argument('--steps', type=int, nargs='+', default=[100, 200, 400, 800, 1600], help="number of steps of the generated workflows")
+parser.add_argument('--outputs', type=int, default=10, help="number of File outputs of every step")
+parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the fastest is reported")
+args = parser.parse_args()
+
+import common  # noqa: E402,F401
+import time  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+from generate_spec import chain_spec  # noqa: E402
+from utils.provenance import build_provenance  # noqa: E402
+
+
+# the inputs of build_provenance for a finished execution of the spec, with the workspace the fake REANA
+# leaves behind: every File output of a step is cwl/<step>/<step>_<output id>.out and is listed in map.txt
+def capture_inputs(spec):
+    start = datetime(2024, 1, 1)
+    workflow_execution = SimpleNamespace(
+        reana_id='bench', reana_name='bench', reana_run_number='1', username='bench',
+        start_time=start, end_time=start + timedelta(seconds=len(spec['steps']))
+    )
+    steps = [
+        SimpleNamespace(name=name, start_time=start + timedelta(seconds=i), end_time=start + timedelta(seconds=i + 1))
+        for i, name in enumerate(spec['steps'])
+    ]
+
+    def workspace_file(name):
+        return {'name': name, 'size': {'raw': 1, 'human_readable': '1 Bytes'}, 'last-modified': start.isoformat()}
+
+    workflow_files = [workspace_file('workflow.json')]
+    map_file_content = []
+    for name, step in spec['steps'].items():
+        for o in step['run']['outputs']:
+            file_name = f"{name}_{o['id']}.out"
+            workflow_files.append(workspace_file(f"cwl/{name}/{file_name}"))
+            map_file_content.append(f"{o['id']},{file_name}")
+    last_step = list(spec['steps'])[-1]
+    for o in spec['outputs']:
+        workflow_files.append(workspace_file(f"outputs/{last_step}_{o['outputSource'].split('/')[-1]}.out"))
+    workflow_files.append(workspace_file('outputs/map.txt'))
+    return workflow_execution, steps, spec, workflow_files, map_file_content, {}
+
+
+def main():
+    print(f"{'steps':>6} {'files':>7} {'relations':>10} {'time (ms)':>10} {'us per file':>12}")
+    for step_count in args.steps:
+        inputs = capture_inputs(chain_spec(step_count, args.outputs))
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            entities, activities, agents, used, generated = build_provenance(*inputs)
+            times.append(time.perf_counter() - start)
+        files = len(inputs[3])
+        print(f"{step_count:>6} {files:>7} {len(used) + len(generated):>10} {min(times) * 1000:>10.1f} {min(times) * 1e6 / files:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
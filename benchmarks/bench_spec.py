@@ -0,0 +1,47 @@
+import argparse
+
+parser = argparse.ArgumentParser(description="Parse and dump time of specification files, compared with the pure Python YAML loader")
+parser.add_argument('--steps', type=int, nargs='+', default=[1, 20, 300], help="number of steps of the generated specifications")
+parser.add_argument('--outputs', type=int, default=10, help="number of File outputs of every step")
+parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the fastest is reported")
+args = parser.parse_args()
+
+import common  # noqa: E402,F401
+import json  # noqa: E402
+import time  # noqa: E402
+from ruamel.yaml import YAML  # noqa: E402
+from generate_spec import chain_spec  # noqa: E402
+from utils import spec  # noqa: E402
+
+
+def best_time(func, document):
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = func(document)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+# how specification files were parsed before utils/spec.py
+pure_yaml = YAML(typ='safe', pure=True)
+
+
+def pure_load(document):
+    return pure_yaml.load(document)
+
+
+def main():
+    print(f"{'steps':>6} {'format':>7} {'size (KiB)':>11} {'pure load (ms)':>15} {'load (ms)':>10} {'dump (ms)':>10}")
+    for steps in args.steps:
+        data = chain_spec(steps, args.outputs)
+        for format, document in (('yaml', spec.dump(data).decode('utf-8')), ('json', json.dumps(data))):
+            pure_time, pure_result = best_time(pure_load, document)
+            load_time, result = best_time(spec.load, document)
+            assert result == pure_result
+            dump_time, _ = best_time(spec.dump, result)
+            print(f"{steps:>6} {format:>7} {len(document) / 1024:>11.1f} {pure_time * 1000:>15.1f} {load_time * 1000:>10.1f} {dump_time * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+
+# the latency must be set before the fake REANA is imported
+parser = argparse.ArgumentParser(description="Submission staging time against a fake REANA with injected transfer latency")
+parser.add_argument('--entities', type=int, default=8, help="number of input entities to stage")
+parser.add_argument('--latency', type=float, default=0.1, help="latency (in seconds) of every download and upload")
+args = parser.parse_args()
+os.environ['FAKE_REANA_TRANSFER_LATENCY'] = str(args.latency)
+
+import common  # noqa: E402
+import asyncio  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+from crud import workflow_execution  # noqa: E402
+from utils import reana  # noqa: E402
+from utils.fake_reana import client  # noqa: E402
+
+
+def create_workflow(name):
+    with tempfile.NamedTemporaryFile('w', dir=common.BENCHMARK_DIR, suffix='.json', delete=False) as spec:
+        spec.write('{"steps": {}}')
+    return client.create_workflow_from_json(name, access_token='', workflow_file=spec.name)['workflow_id']
+
+
+# every entity is a file of another (running, so never cached) execution: it is downloaded from REANA and uploaded again.
+# Everything runs in one event loop, as in the API (the REANA gateway's semaphores belong to a loop)
+async def main():
+    source = create_workflow('source')
+    for i in range(args.entities):
+        client._add_file(client._get(source), f"outputs/file_{i}", os.urandom(1024))
+    source_executions = {1: SimpleNamespace(reana_id=source, status='running')}
+    needed_entities = [
+        {'type': 'valueFromEntity', 'data': SimpleNamespace(workflow_execution_id=1, path=f"outputs/file_{i}", name=f"file_{i}")}
+        for i in range(args.entities)
+    ]
+
+    print(f"{args.entities} entities, {args.latency * 1000:.0f} ms per transfer "
+          f"(at most {reana.REANA_TRANSFER_CONCURRENCY} transfers at once in the REANA gateway)")
+    print(f"{'STAGING_CONCURRENCY':>20} {'time (s)':>10}")
+    for concurrency in (1, 2, 4, 8):
+        workflow_execution.STAGING_CONCURRENCY = concurrency
+        target = create_workflow('target')
+        start = time.perf_counter()
+        await workflow_execution.stage_entities(target, needed_entities, source_executions)
+        print(f"{concurrency:>20} {time.perf_counter() - start:>10.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
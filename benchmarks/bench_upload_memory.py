@@ -0,0 +1,91 @@
+import argparse
+
+parser = argparse.ArgumentParser(description="Peak memory of uploading AIoD platform datasets to REANA, for increasing file sizes")
+parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help="file sizes in MB")
+args = parser.parse_args()
+
+import common  # noqa: E402
+import asyncio  # noqa: E402
+import os  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: E402
+import requests  # noqa: E402
+from utils import reana  # noqa: E402
+
+MB = 1024 * 1024
+
+
+# REANA's upload endpoint: reads the request body in small chunks and discards it.
+# The server runs in this process, so its buffers are part of the measured peak
+class SinkHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+sink = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+
+# the request reana_client.api.client.upload_file sends (file_ is either bytes or a file object)
+def upload_file(workflow, file_, file_name, access_token):
+    response = requests.post(
+        f"http://127.0.0.1:{sink.server_port}/api/workflows/{workflow}/workspace",
+        data=file_,
+        params={'file_name': file_name, 'access_token': access_token},
+        headers={'Content-Type': 'application/octet-stream'},
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+reana.client.upload_file = upload_file
+
+
+# what execute_workflow did before: the whole dataset is read in memory and uploaded as bytes
+async def read_and_upload(path):
+    with open(path, 'rb') as f:
+        content = f.read()
+    await reana.upload_file(workflow='bench', file_=content, file_name=os.path.basename(path))
+
+
+async def upload_from_path(path):
+    await reana.upload_file_from_path(workflow='bench', path=path, file_name=os.path.basename(path))
+
+
+async def measure(upload, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    await upload(path)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / MB, elapsed
+
+
+async def main():
+    print(f"{'file (MB)':>10} {'read + upload peak (MB)':>24} {'time (s)':>9} {'streamed peak (MB)':>19} {'time (s)':>9}")
+    for size in args.sizes:
+        path = os.path.join(common.BENCHMARK_DIR, f"dataset_{size}MB.bin")
+        with open(path, 'wb') as f:
+            f.truncate(size * MB)
+        read_peak, read_time = await measure(read_and_upload, path)
+        streamed_peak, streamed_time = await measure(upload_from_path, path)
+        os.remove(path)
+        print(f"{size:>10} {read_peak:>24.1f} {read_time:>9.2f} {streamed_peak:>19.1f} {streamed_time:>9.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
+    sink.shutdown()
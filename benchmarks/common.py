@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+# Benchmarks run the API against a temporary SQLite database and the in-memory REANA (see src/utils/fake_reana.py).
+# Import this module before any module of the API; settings already present in the environment are kept,
+# e.g. FAKE_REANA_LATENCY=0.05 python benchmarks/load_test.py
+BENCHMARK_DIR = tempfile.mkdtemp(prefix='provenance-api-benchmark-')
+for name, value in {
+    'DATABASE_URL': f"sqlite:///{os.path.join(BENCHMARK_DIR, 'benchmark.db')}",
+    'REANA_BACKEND': 'fake',
+    'REANA_ACCESS_TOKEN': 'benchmark-token',
+    'REANA_SERVER_URL': 'http://reana.benchmark',
+    'KEYCLOAK_AUTHORIZATION_URL': 'http://keycloak.benchmark/auth',
+    'KEYCLOAK_TOKEN_URL': 'http://keycloak.benchmark/token',
+    'KEYCLOAK_SERVER_URL': 'http://keycloak.benchmark/',
+    'KEYCLOAK_CLIENT_ID': 'provenance-api',
+    'KEYCLOAK_REALM': 'benchmark',
+    'KEYCLOAK_CLIENT_SECRET': '',
+    'ARTIFACT_CACHE_DIR': os.path.join(BENCHMARK_DIR, 'artifact_cache'),
+    'RENDER_CACHE_DIR': os.path.join(BENCHMARK_DIR, 'render_cache'),
+}.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,33 @@
+import argparse
+import json
+
+
+# returns a CWL workflow of `steps` command line tools in a chain, each with `outputs` File outputs.
+# Every step uses the first output of the previous one, the workflow outputs are the outputs of the last step
+def chain_spec(steps, outputs):
+    spec = {'cwlVersion': 'v1.2', 'class': 'Workflow', 'inputs': [{'id': 'n', 'type': 'int'}], 'outputs': [], 'steps': {}}
+    for i in range(steps):
+        step_outputs = [
+            {'id': f"o_{i}_{j}", 'type': 'File', 'outputBinding': {'glob': f"$(inputs.g_{i}_{j})"}}
+            for j in range(outputs)
+        ]
+        spec['steps'][f"s{i}"] = {
+            'in': {'n': 'n'} if i == 0 else {'x': f"s{i - 1}/o_{i - 1}_0"},
+            'out': [o['id'] for o in step_outputs],
+            'run': {
+                'class': 'CommandLineTool',
+                'baseCommand': 'echo',
+                'inputs': {'n': 'int'} if i == 0 else {'x': 'File'},
+                'outputs': step_outputs,
+            },
+        }
+    spec['outputs'] = [{'id': f"out{j}", 'type': 'File', 'outputSource': f"s{steps - 1}/o_{steps - 1}_{j}"} for j in range(outputs)]
+    return spec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print a generated CWL workflow (as JSON) to use in benchmarks")
+    parser.add_argument('--steps', type=int, default=10, help="number of steps")
+    parser.add_argument('--outputs', type=int, default=3, help="number of File outputs of every step")
+    args = parser.parse_args()
+    print(json.dumps(chain_spec(args.steps, args.outputs)))
@@ -0,0 +1,73 @@
+import argparse
+import os
+
+parser = argparse.ArgumentParser(description="Throughput of workflow submissions for increasing numbers of concurrent clients")
+parser.add_argument('--requests', type=int, default=64, help="number of submissions per run")
+parser.add_argument('--latency', type=float, default=0.05, help="latency (in seconds) of every REANA API call")
+args = parser.parse_args()
+os.environ['FAKE_REANA_LATENCY'] = str(args.latency)
+# a small pool shows that submissions waiting for REANA don't hold connections
+os.environ.setdefault('DB_POOL_SIZE', '4')
+os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+os.environ.setdefault('DB_POOL_TIMEOUT', '5')
+
+import common  # noqa: E402,F401
+import asyncio  # noqa: E402
+import time  # noqa: E402
+import httpx  # noqa: E402
+from authentication.auth import authenticate_user  # noqa: E402
+from main import app  # noqa: E402
+from models.user import User  # noqa: E402
+from schema.init_db import DB_MAX_OVERFLOW, DB_POOL_SIZE, engine  # noqa: E402
+from utils import reana  # noqa: E402
+
+SPEC = """{"cwlVersion": "v1.2", "class": "Workflow", "inputs": [], "outputs": [],
+"steps": {"echo": {"in": {}, "out": [], "run": {"class": "CommandLineTool", "baseCommand": "echo", "inputs": {}, "outputs": []}}}}"""
+
+
+# every client submits executions one after another until the run's submissions are used up
+async def run(client, registry_id, concurrency):
+    remaining = args.requests
+    failures = 0
+    checked_out = 0
+
+    async def submitter():
+        nonlocal remaining, failures
+        while remaining > 0:
+            remaining -= 1
+            response = await client.post(f'/workflow_execution/execute/{registry_id}')
+            if not response.json()['success']:
+                failures += 1
+
+    async def sample_pool():
+        nonlocal checked_out
+        while True:
+            checked_out = max(checked_out, engine.pool.checkedout())
+            await asyncio.sleep(0.005)
+
+    sampler = asyncio.ensure_future(sample_pool())
+    start = time.perf_counter()
+    await asyncio.gather(*(submitter() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    return args.requests / elapsed, failures, checked_out
+
+
+async def main():
+    app.dependency_overrides[authenticate_user] = lambda: User('1', 'bench', 'bench@example.com', 'bench', 'B', 'B', [], [])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://api', timeout=None) as client:
+        response = await client.post(
+            '/workflow_registry/register/', params={'name': 'bench', 'version': '1'}, files={'spec_file': ('workflow.cwl', SPEC)}
+        )
+        registry_id = response.json()['data']['registry_id']
+
+        print(f"{args.requests} submissions per run, {args.latency * 1000:.0f} ms per REANA call (2 calls per submission), "
+              f"{DB_POOL_SIZE + DB_MAX_OVERFLOW} database connections, at most {reana.REANA_API_CONCURRENCY} REANA calls at once")
+        print(f"{'clients':>8} {'submissions/s':>14} {'failed':>7} {'max connections in use':>23}")
+        for concurrency in (1, 2, 4, 8, 16, 32):
+            throughput, failures, checked_out = await run(client, registry_id, concurrency)
+            print(f"{concurrency:>8} {throughput:>14.1f} {failures:>7} {checked_out:>23}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
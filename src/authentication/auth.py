@@ -1,4 +1,10 @@
+import asyncio
+import hashlib
 import os
+import time
+from collections import OrderedDict
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2AuthorizationCodeBearer
 from models.user import User
 from keycloak import KeycloakOpenID
@@ -18,25 +24,62 @@ keycloak_openid = KeycloakOpenID(
 )
 
 
-async def get_idp_public_key():
+# the IdP public key is cached and refreshed every KEYCLOAK_PUBLIC_KEY_TTL seconds,
+# or earlier if a token signature fails to verify (the key may have been rotated)
+KEYCLOAK_PUBLIC_KEY_TTL = int(os.environ.get('KEYCLOAK_PUBLIC_KEY_TTL', 300))
+KEYCLOAK_PUBLIC_KEY_MIN_REFRESH_INTERVAL = 10
+# claims of verified tokens are cached (keyed by token hash) until the token expires
+VERIFIED_TOKEN_CACHE_SIZE = int(os.environ.get('VERIFIED_TOKEN_CACHE_SIZE', 1024))
+
+_public_key = {'value': None, 'fetched_at': 0.0}
+_public_key_lock = asyncio.Lock()
+_verified_tokens = OrderedDict()
+
+
+async def get_idp_public_key(force_refresh=False):
+    age = time.monotonic() - _public_key['fetched_at']
+    if _public_key['value'] is None or age > KEYCLOAK_PUBLIC_KEY_TTL or (force_refresh and age > KEYCLOAK_PUBLIC_KEY_MIN_REFRESH_INTERVAL):
+        async with _public_key_lock:
+            # another request may have refreshed the key while we were waiting
+            if _public_key['value'] is None or time.monotonic() - _public_key['fetched_at'] >= age:
+                _public_key['value'] = await run_in_threadpool(keycloak_openid.public_key)
+                _public_key['fetched_at'] = time.monotonic()
     return (
         "-----BEGIN PUBLIC KEY-----\n"
-        f"{keycloak_openid.public_key()}"
+        f"{_public_key['value']}"
         "\n-----END PUBLIC KEY-----"
     )
 
 
+def decode_token(token, key):
+    return keycloak_openid.decode_token(
+        token,
+        key=key,
+        options={
+            "verify_signature": True,
+            "verify_aud": False,
+            "exp": True
+        }
+    )
+
+
 async def get_payload(token: str = Security(oauth2_scheme)) -> dict:
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    cached = _verified_tokens.get(token_hash)
+    if cached is not None:
+        if cached['exp'] > time.time():
+            _verified_tokens.move_to_end(token_hash)
+            return cached['payload']
+        _verified_tokens.pop(token_hash, None)
+
     try:
-        return keycloak_openid.decode_token(
-            token,
-            key=await get_idp_public_key(),
-            options={
-                "verify_signature": True,
-                "verify_aud": False,
-                "exp": True
-            }
-        )
+        try:
+            payload = decode_token(token, await get_idp_public_key())
+        except (ExpiredSignatureError, JWTClaimsError):
+            raise
+        except JWTError:
+            # signature could not be verified, retry once with a fresh key in case it was rotated
+            payload = decode_token(token, await get_idp_public_key(force_refresh=True))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -44,6 +87,12 @@ async def get_payload(token: str = Security(oauth2_scheme)) -> dict:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if 'exp' in payload:
+        _verified_tokens[token_hash] = {'exp': payload['exp'], 'payload': payload}
+        while len(_verified_tokens) > VERIFIED_TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return payload
+
 
 async def authenticate_user(payload: dict = Depends(get_payload)) -> User:
     try:
@@ -0,0 +1,26 @@
+import asyncio
+from fastapi import APIRouter, Depends
+from authentication.auth import authenticate_user
+from models.user import User
+from models.response import Response
+from utils.artifact_cache import artifact_cache, render_cache
+
+router = APIRouter()
+
+
+@router.get(
+    "/stats",
+    description="Hit, miss and eviction counters and sizes (in bytes) of the caches of REANA files and of rendered provenance graphs",
+)
+async def cache_stats(
+    user: User = Depends(authenticate_user)
+):
+    data = {
+        'artifacts': await asyncio.to_thread(artifact_cache.stats),
+        'renders': await asyncio.to_thread(render_cache.stats),
+    }
+    return Response(
+        success=True,
+        message="Cache statistics successfully retrieved",
+        data=data
+    )
@@ -1,15 +1,26 @@
 import asyncio
+import hashlib
+import logging
 import os
-from fastapi.responses import FileResponse
-from fastapi import APIRouter, BackgroundTasks, Depends
-from starlette.background import BackgroundTask
+from collections import Counter
+from fastapi.responses import Response as HTTPResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Header, Query
+from starlette.concurrency import run_in_threadpool
 from schema.workflow_execution import WorkflowExecution, WorkflowExecutionStep
 from schema.workflow_registry import WorkflowRegistry
-from schema.init_db import session
+from schema.job import Job
+from schema.execution_batch import ExecutionBatch
+from schema.init_db import get_session, run_in_db
+from sqlalchemy.orm import Session, selectinload, undefer_group
 from authentication.auth import authenticate_user
 from models.user import User
-from utils.cwl import add_mapping_step, replace_placeholders
-from reana_client.api import client
+from models.batch import BatchExecutionRequest
+from utils.cwl import compile_spec, get_parsed_spec, platform_inputs
+from utils.pagination import keyset_paginate
+from utils import aiod, artifact_cache, reana
+from utils.execution_monitor import TERMINAL_STATUSES, execution_monitor
+from utils.jobs import enqueue_job
+from utils.provenance import delete_provenance
 import tempfile
 from datetime import datetime
 import urllib3
@@ -18,22 +29,60 @@ from sqlalchemy.exc import SQLAlchemyError
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# maximum number of input entities of an execution that are transferred to REANA at once
+STAGING_CONCURRENCY = int(os.environ.get('STAGING_CONCURRENCY', 4))
+# maximum number of runs of a batch that are submitted to REANA at once, and maximum number of runs in a batch
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 100))
+
 
 @router.get(
     "/",
-    description="List all workflows that have been executed",
+    description="List all workflows that have been executed. "
+                "Results are paginated: pass the execution_id of the last execution received as after_id to get the next page.",
 )
 async def list_executed_workflows(
+    include_steps: bool = True,
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: int = None,
+    sort: str = Query('id', pattern='^-?(id|start_time)$'),
+    status: str = None,
+    registry_id: int = None,
+    batch_id: int = None,
+    username: str = None,
+    start_time_from: datetime = None,
+    start_time_to: datetime = None,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
+    query = session.query(WorkflowExecution).filter(
+        WorkflowExecution.group == user.group
+    )
+    if status is not None:
+        query = query.filter(WorkflowExecution.status == status)
+    if registry_id is not None:
+        query = query.filter(WorkflowExecution.registry_id == registry_id)
+    if batch_id is not None:
+        query = query.filter(WorkflowExecution.batch_id == batch_id)
+    if username is not None:
+        query = query.filter(WorkflowExecution.username == username)
+    if start_time_from is not None:
+        query = query.filter(WorkflowExecution.start_time >= start_time_from)
+    if start_time_to is not None:
+        query = query.filter(WorkflowExecution.start_time < start_time_to)
+    query = keyset_paginate(query, WorkflowExecution, sort, after_id, limit)
+    if include_steps:
+        # load the steps of every execution with a single IN query
+        query = query.options(selectinload(WorkflowExecution.steps))
     try:
-        workflow_executions = session.query(WorkflowExecution).filter(
-            WorkflowExecution.group == user.group
-        ).all()
+        workflow_executions = await run_in_db(query.all)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -53,30 +102,17 @@ async def list_executed_workflows(
             'reana_name': workflow_execution.reana_name,
             'reana_run_number': workflow_execution.reana_run_number,
             'registry_id': workflow_execution.registry_id,
-            'steps': []
         }
-        try:
-            workflow_execution_steps = session.query(WorkflowExecutionStep).filter(
-                WorkflowExecutionStep.workflow_execution_id == workflow_execution.id
-            ).all()
-        except SQLAlchemyError as e:
-            session.rollback()
-            return Response(
-                success=False,
-                message=f"Database error: {str(e)}",
-                error_code=500,
-                data={}
-            )
-        for step in workflow_execution_steps:
-            workflow_data['steps'].append(
+        if include_steps:
+            workflow_data['steps'] = [
                 {
                     'step_id': step.id,
                     'name': step.name,
                     'status': step.status,
                     'start_time': step.start_time,
                     'end_time': step.end_time
-                }
-            )
+                } for step in workflow_execution.steps
+            ]
         name = f"{workflow_execution.reana_name}:{workflow_execution.reana_run_number}"
         data[name] = workflow_data
     return Response(
@@ -92,15 +128,18 @@ async def list_executed_workflows(
 )
 async def get_workflow_execution_by_id(
     execution_id: int,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow_execution = session.query(WorkflowExecution).filter(
+        workflow_execution = await run_in_db(session.query(WorkflowExecution).options(
+            selectinload(WorkflowExecution.steps)
+        ).filter(
             WorkflowExecution.id == execution_id,
             WorkflowExecution.group == user.group
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -124,30 +163,16 @@ async def get_workflow_execution_by_id(
         'reana_name': workflow_execution.reana_name,
         'reana_run_number': workflow_execution.reana_run_number,
         'registry_id': workflow_execution.registry_id,
-        'steps': []
-    }
-    try:
-        workflow_execution_steps = session.query(WorkflowExecutionStep).filter(
-            WorkflowExecutionStep.workflow_execution_id == workflow_execution.id
-        ).all()
-    except SQLAlchemyError as e:
-        session.rollback()
-        return Response(
-            success=False,
-            message=f"Database error: {str(e)}",
-            error_code=500,
-            data={}
-        )
-    for step in workflow_execution_steps:
-        data['steps'].append(
+        'steps': [
             {
                 'step_id': step.id,
                 'name': step.name,
                 'status': step.status,
                 'start_time': step.start_time,
                 'end_time': step.end_time
-            }
-        )
+            } for step in workflow_execution.steps
+        ]
+    }
     return {
         "success": True,
         "message": "Workflow execution successfully retrieved",
@@ -161,16 +186,18 @@ async def get_workflow_execution_by_id(
 )
 async def execute_workflow(
     registry_id: int,
-    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow_registry = session.query(WorkflowRegistry).filter(
+        workflow_registry = await run_and_release(session, session.query(WorkflowRegistry).options(
+            undefer_group('content')
+        ).filter(
             WorkflowRegistry.id == registry_id,
             WorkflowRegistry.group == user.group
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -185,219 +212,434 @@ async def execute_workflow(
             error_code=404,
             data={}
         )
-    with tempfile.NamedTemporaryFile(dir=os.getcwd(), suffix='.cwl', delete=False) as spec_temp_file:
-        spec_file_with_mapping_step = add_mapping_step(workflow_registry.spec_file_content.encode('utf-8'))
-        spec_file_without_placeholders, needed_entities = replace_placeholders(spec_file_with_mapping_step)
-        if spec_file_without_placeholders is None and needed_entities is None:
+    submission = await prepare_submission(session, workflow_registry)
+    if isinstance(submission, Response):
+        return submission
+
+    try:
+        workflow_run, error = await submit_run(submission, submission['inputs'])
+        if workflow_run is None:
             return Response(
                 success=False,
-                message="Invalid entity id in placeholder",
-                error_code=404,
+                message=error,
+                error_code=503,
                 data={}
             )
 
-        spec_temp_file.write(spec_file_without_placeholders)
+        try:
+            workflow_execution = (await run_in_db(record_executions, session, user, [(registry_id, workflow_run)]))[0]
+        except SQLAlchemyError as e:
+            await run_in_db(session.rollback)
+            return Response(
+                success=False,
+                message=f"Database error: {str(e)}",
+                error_code=500,
+                data={}
+            )
+        execution_monitor.notify()
+    finally:
+        os.remove(submission['spec_path'])
 
-    inputs = {"parameters": {}}
-    if workflow_registry.input_file_content:
-        with tempfile.NamedTemporaryFile(dir=os.getcwd(), suffix='.yaml', delete=False) as input_temp_file:
-            input_temp_file.write(workflow_registry.input_file_content.encode('utf-8'))
-        with open(os.path.join(os.getcwd(), input_temp_file.name)) as f:
-            for line in f:
-                k, v = line.strip().split(": ")
-                inputs["parameters"][k] = v
+    data = {
+        "username": user.username,
+        "group": user.group,
+        "execution_id": workflow_execution.id,
+        "name": workflow_registry.name,
+        "version": workflow_registry.version,
+        "reana_name": workflow_execution.reana_name,
+        "reana_id": workflow_execution.reana_id,
+        "run_number": workflow_execution.reana_run_number,
+    }
+    return Response(
+        success=True,
+        message="New workflow started",
+        data=data
+    )
 
-    for entity in needed_entities:
-        if entity['type'] == 'aiod-platform':
-            content_url = entity['data']['distribution'][0]['content_url']
-            path = content_url[len('file://'):]
 
-            inputs['parameters'][entity['id']] = {
-                'class': 'File',
-                'path': content_url.split('/')[-1],
-            }
+@router.post(
+    "/batch",
+    description="Execute many registered workflows, or one registered workflow with many sets of input parameters, as a batch"
+)
+async def execute_batch(
+    batch_request: BatchExecutionRequest,
+    session: Session = Depends(get_session),
+    user: User = Depends(authenticate_user)
+):
+    if bool(batch_request.registry_ids) == (batch_request.registry_id is not None):
+        return Response(
+            success=False,
+            message="Either registry_ids or registry_id with parameter_sets must be given",
+            error_code=400,
+            data={}
+        )
+    if batch_request.registry_id is not None and not batch_request.parameter_sets:
+        return Response(
+            success=False,
+            message="parameter_sets must be given together with registry_id",
+            error_code=400,
+            data={}
+        )
+    batch_size = len(batch_request.registry_ids) or len(batch_request.parameter_sets)
+    if batch_size > BATCH_MAX_SIZE:
+        return Response(
+            success=False,
+            message=f"A batch can contain at most {BATCH_MAX_SIZE} runs",
+            error_code=400,
+            data={}
+        )
 
+    registry_ids = set(batch_request.registry_ids) or {batch_request.registry_id}
     try:
-        reana_workflow = client.create_workflow_from_json(
-            name=f"{workflow_registry.name}:{workflow_registry.version}",
-            access_token=os.environ['REANA_ACCESS_TOKEN'],
-            workflow_file=os.path.join(os.getcwd(), spec_temp_file.name),
-            parameters=inputs,
-            workflow_engine='cwl'
+        workflow_registries = await run_and_release(session, session.query(WorkflowRegistry).options(
+            undefer_group('content')
+        ).filter(
+            WorkflowRegistry.id.in_(registry_ids),
+            WorkflowRegistry.group == user.group
+        ).all)
+    except SQLAlchemyError as e:
+        await run_in_db(session.rollback)
+        return Response(
+            success=False,
+            message=f"Database error: {str(e)}",
+            error_code=500,
+            data={}
         )
-    except Exception as e:
-        os.remove(os.path.join(os.getcwd(), spec_temp_file.name))
-        if workflow_registry.input_file_content:
-            os.remove(os.path.join(os.getcwd(), input_temp_file.name))
+
+    invalid_registry_ids = registry_ids - {w.id for w in workflow_registries}
+    if invalid_registry_ids:
+        return Response(
+            success=False,
+            message=f"Invalid registry_id: {', '.join(str(i) for i in sorted(invalid_registry_ids))}",
+            error_code=404,
+            data={}
+        )
+
+    # every workflow is compiled once, whatever the number of its runs
+    submissions = {}
+    try:
+        for workflow_registry in workflow_registries:
+            submission = await prepare_submission(session, workflow_registry)
+            if isinstance(submission, Response):
+                return submission
+            submissions[workflow_registry.id] = submission
+
+        # (registry id, inputs) of every run
+        if batch_request.registry_ids:
+            runs = [(registry_id, submissions[registry_id]['inputs']) for registry_id in batch_request.registry_ids]
+        else:
+            inputs = submissions[batch_request.registry_id]['inputs']
+            runs = [
+                (batch_request.registry_id, {**inputs, 'parameters': {**inputs['parameters'], **parameter_set}})
+                for parameter_set in batch_request.parameter_sets
+            ]
+
+        semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+        async def _submit(registry_id, inputs):
+            async with semaphore:
+                return await submit_run(submissions[registry_id], inputs)
+
+        results = await asyncio.gather(*(_submit(registry_id, inputs) for registry_id, inputs in runs))
+    finally:
+        for submission in submissions.values():
+            os.remove(submission['spec_path'])
+
+    started = [(registry_id, workflow_run) for (registry_id, _), (workflow_run, _) in zip(runs, results) if workflow_run is not None]
+    errors = [
+        {'index': i, 'registry_id': registry_id, 'message': error}
+        for i, ((registry_id, _), (_, error)) in enumerate(zip(runs, results)) if error is not None
+    ]
+    if not started:
         return Response(
             success=False,
-            message="Problem while creating REANA workflow: " + str(e),
+            message="No run of the batch could be started",
             error_code=503,
+            data={'errors': errors}
+        )
+
+    try:
+        execution_batch, workflow_executions = await run_in_db(record_batch, session, user, len(runs), started)
+    except SQLAlchemyError as e:
+        await run_in_db(session.rollback)
+        return Response(
+            success=False,
+            message=f"Database error: {str(e)}",
+            error_code=500,
             data={}
         )
+    execution_monitor.notify()
 
+    data = {
+        "batch_id": execution_batch.id,
+        "executions": [
+            {
+                "execution_id": workflow_execution.id,
+                "registry_id": workflow_execution.registry_id,
+                "reana_name": workflow_execution.reana_name,
+                "reana_id": workflow_execution.reana_id,
+                "run_number": workflow_execution.reana_run_number,
+            } for workflow_execution in workflow_executions
+        ],
+        "errors": errors,
+    }
+    return Response(
+        success=True,
+        message="Batch started" if not errors else f"Batch started, {len(errors)} of {len(runs)} runs could not be started",
+        data=data
+    )
+
+
+@router.get(
+    "/batch/{batch_id}",
+    description="Get the aggregate status of a batch of executions",
+)
+async def get_batch(
+    batch_id: int,
+    session: Session = Depends(get_session),
+    user: User = Depends(authenticate_user)
+):
     try:
-        for entity in needed_entities:
-            if entity['type'] == 'valueFromEntity':
-                try:
-                    prev_execution = session.query(WorkflowExecution.reana_id).filter(WorkflowExecution.id == entity['data'].workflow_execution_id).first()
-                except SQLAlchemyError as e:
-                    session.rollback()
-                    return Response(
-                        success=False,
-                        message=f"Database error: {str(e)}",
-                        error_code=500,
-                        data={}
-                    )
-                file_name = entity['data'].path
-                downloaded_entity = client.download_file(
-                    workflow=prev_execution.reana_id,
-                    file_name=file_name,
-                    access_token=os.environ['REANA_ACCESS_TOKEN'],
-                )
-
-                client.upload_file(
-                    workflow=reana_workflow['workflow_id'],
-                    file_=downloaded_entity[0],
-                    file_name=entity['data'].name,
-                    access_token=os.environ['REANA_ACCESS_TOKEN']
-                )
-            elif entity['type'] == 'aiod-platform':
-                content_url = entity['data']['distribution'][0]['content_url']
-                path = content_url[len('file://'):]
-                with open(path, "rb") as f:
-                    file_content = f.read()
-                client.upload_file(
-                    workflow=reana_workflow['workflow_id'],
-                    file_=file_content,
-                    file_name=content_url.split('/')[-1],
-                    access_token=os.environ['REANA_ACCESS_TOKEN']
-                )
-
-        workflow_run = client.start_workflow(
-            workflow=reana_workflow['workflow_id'],
-            access_token=os.environ['REANA_ACCESS_TOKEN'],
-            parameters={}
-        )
-        workflow_execution = WorkflowExecution(
-            username=user.username,
-            group=user.group,
-            registry_id=registry_id,
-            reana_id=workflow_run['workflow_id'],
-            reana_name=workflow_run['workflow_name'],
-            reana_run_number=workflow_run['run_number'],
+        execution_batch = await run_in_db(session.query(ExecutionBatch).options(
+            selectinload(ExecutionBatch.executions)
+        ).filter(
+            ExecutionBatch.id == batch_id,
+            ExecutionBatch.group == user.group
+        ).first)
+    except SQLAlchemyError as e:
+        await run_in_db(session.rollback)
+        return Response(
+            success=False,
+            message=f"Database error: {str(e)}",
+            error_code=500,
+            data={}
         )
-        background_tasks.add_task(monitor_execution, workflow_execution.reana_id)
-        session.add(workflow_execution)
-        session.commit()
-        session.refresh(workflow_execution)
+
+    if execution_batch is None:
+        return Response(
+            success=False,
+            message="Invalid batch_id",
+            error_code=404,
+            data={}
+        )
+
+    statuses = [workflow_execution.status for workflow_execution in execution_batch.executions]
+    if any(status not in TERMINAL_STATUSES for status in statuses):
+        batch_status = 'running'
+    elif len(statuses) == execution_batch.size and all(status == 'finished' for status in statuses):
+        batch_status = 'finished'
+    else:
+        batch_status = 'failed'
+
+    data = {
+        "batch_id": execution_batch.id,
+        "username": execution_batch.username,
+        "group": execution_batch.group,
+        "created_at": execution_batch.created_at,
+        "size": execution_batch.size,
+        "status": batch_status,
+        "status_counts": dict(Counter(statuses)),
+        "executions": [
+            {
+                "execution_id": workflow_execution.id,
+                "registry_id": workflow_execution.registry_id,
+                "status": workflow_execution.status,
+                "start_time": workflow_execution.start_time,
+                "end_time": workflow_execution.end_time,
+                "reana_name": workflow_execution.reana_name,
+                "reana_run_number": workflow_execution.reana_run_number,
+            } for workflow_execution in execution_batch.executions
+        ],
+    }
+    return {
+        "success": True,
+        "message": "Batch successfully retrieved",
+        "data": data
+    }
+
+
+# runs a query and ends the transaction of the request's session in the same database call.
+# Used before slow network calls (AIoD platform, REANA): the connection goes back to the pool right away,
+# instead of being held by the submission (or waiting for a free executor thread to be released).
+# Loaded objects stay usable, the session starts a new transaction the next time it is used
+async def run_and_release(session, query):
+    def _run():
+        try:
+            return query()
+        finally:
+            session.close()
+
+    return await run_in_db(_run)
+
+
+# compiles a registered workflow and writes its specification file to disk (spec_path, removed by the caller).
+# returns what is needed to submit runs of the workflow, or the error response
+async def prepare_submission(session, workflow_registry):
+    spec = await run_in_threadpool(get_parsed_spec, workflow_registry)
+    try:
+        metadata = await aiod.resolve_platform_metadata(platform_inputs(spec))
     except Exception as e:
-        os.remove(os.path.join(os.getcwd(), spec_temp_file.name))
-        if workflow_registry.input_file_content:
-            os.remove(os.path.join(os.getcwd(), input_temp_file.name))
-        session.rollback()
         return Response(
             success=False,
-            message="Problem while starting REANA workflow: " + str(e),
+            message="Problem while retrieving metadata from the AIoD platform: " + str(e),
             error_code=503,
             data={}
         )
-    finally:
-        os.remove(os.path.join(os.getcwd(), spec_temp_file.name))
-        if workflow_registry.input_file_content:
-            os.remove(os.path.join(os.getcwd(), input_temp_file.name))
-        data = {
-            "username": user.username,
-            "group": user.group,
-            "execution_id": workflow_execution.id,
-            "name": workflow_registry.name,
-            "version": workflow_registry.version,
-            "reana_name": workflow_execution.reana_name,
-            "reana_id": workflow_execution.reana_id,
-            "run_number": workflow_execution.reana_run_number,
-        }
+    if metadata is None:
         return Response(
-            success=True,
-            message="New workflow started",
-            data=data
+            success=False,
+            message="Invalid entity id in placeholder",
+            error_code=404,
+            data={}
         )
+    spec_file_compiled, needed_entities = await run_in_threadpool(compile_spec, workflow_registry.spec_file_content, spec, metadata)
 
+    inputs = {"parameters": {}}
+    if workflow_registry.input_file_content:
+        for line in workflow_registry.input_file_content.splitlines():
+            k, v = line.strip().split(": ")
+            inputs["parameters"][k] = v
 
-async def monitor_execution(reana_id):
+    for entity in needed_entities:
+        if entity['type'] == 'aiod-platform':
+            content_url = entity['data']['distribution'][0]['content_url']
+            inputs['parameters'][entity['id']] = {
+                'class': 'File',
+                'path': content_url.split('/')[-1],
+            }
+
+    # the executions whose files are used as inputs
+    source_execution_ids = {entity['data'].workflow_execution_id for entity in needed_entities if entity['type'] == 'valueFromEntity'}
     try:
-        workflow_execution = session.query(WorkflowExecution).filter(WorkflowExecution.reana_id == reana_id).first()
+        source_executions = {
+            e.id: e for e in await run_and_release(session, session.query(
+                WorkflowExecution.id, WorkflowExecution.reana_id, WorkflowExecution.status
+            ).filter(WorkflowExecution.id.in_(source_execution_ids)).all)
+        } if source_execution_ids else {}
     except SQLAlchemyError as e:
-        session.rollback()
-        return
-
-    prev_step = None
-    while True:
-        workflow_status = client.get_workflow_status(
-            workflow=reana_id,
-            access_token=os.environ['REANA_ACCESS_TOKEN']
-        )
-
-        current_step = workflow_status['progress']['current_step_name']
-        if current_step != prev_step:  # if a new step is running:
-            if prev_step is not None:
-                try:
-                    prev_workflow_execution_step = session.query(WorkflowExecutionStep).filter(
-                        WorkflowExecutionStep.workflow_execution_id == workflow_execution.id,
-                        WorkflowExecutionStep.name == prev_step,
-                    ).first()
-                except SQLAlchemyError as e:
-                    session.rollback()
-                    return
-                prev_workflow_execution_step.end_time = datetime.utcnow()
-                prev_workflow_execution_step.status = 'finished' if workflow_status['status'] != 'failed' else 'failed'
-                session.add(prev_workflow_execution_step)
-                session.commit()
-
-            current_workflow_execution_step = WorkflowExecutionStep(
-                name=current_step,
-                workflow_execution_id=workflow_execution.id
-            )
-
-            prev_step = current_step
+        await run_in_db(session.rollback)
+        return Response(
+            success=False,
+            message=f"Database error: {str(e)}",
+            error_code=500,
+            data={}
+        )
 
-            session.add(current_workflow_execution_step)
-            session.commit()
+    with tempfile.NamedTemporaryFile(dir=os.getcwd(), suffix='.cwl', delete=False) as spec_temp_file:
+        spec_temp_file.write(spec_file_compiled)
 
-        if workflow_status['status'] != workflow_execution.status:
-            workflow_execution.status = workflow_status['status']
-        if workflow_status['status'] == 'finished' or workflow_status['status'] == 'failed':
-            break
+    return {
+        'name': f"{workflow_registry.name}:{workflow_registry.version}",
+        'spec_path': os.path.join(os.getcwd(), spec_temp_file.name),
+        'inputs': inputs,
+        'needed_entities': needed_entities,
+        'source_executions': source_executions,
+    }
 
-        await asyncio.sleep(0.001)
 
-    final_status = client.get_workflow_status(
-        workflow=reana_id,
-        access_token=os.environ['REANA_ACCESS_TOKEN']
-    )
+# creates a REANA workflow from a prepared submission, stages its inputs and starts it.
+# returns a tuple (workflow run, error message)
+async def submit_run(submission, inputs):
+    try:
+        reana_workflow = await reana.create_workflow(
+            name=submission['name'],
+            workflow_file=submission['spec_path'],
+            parameters=inputs
+        )
+    except Exception as e:
+        return None, "Problem while creating REANA workflow: " + str(e)
 
     try:
-        last_workflow_execution_step = session.query(WorkflowExecutionStep).filter(
-            WorkflowExecutionStep.workflow_execution_id == workflow_execution.id,
-            WorkflowExecutionStep.name == current_step,
-        ).first()
-    except SQLAlchemyError as e:
-        session.rollback()
-        return
+        await stage_entities(reana_workflow['workflow_id'], submission['needed_entities'], submission['source_executions'])
+        return await reana.start_workflow(workflow=reana_workflow['workflow_id']), None
+    except Exception as e:
+        # the created workflow cannot run without its inputs
+        try:
+            await reana.delete_workflow(workflow=reana_workflow['workflow_id'], all_runs=False)
+        except Exception:
+            logger.exception(f"Could not delete REANA workflow {reana_workflow['workflow_id']}")
+        return None, "Problem while starting REANA workflow: " + str(e)
 
-    if last_workflow_execution_step is not None:
-        last_workflow_execution_step.end_time = datetime.utcnow()
-        last_workflow_execution_step.status = final_status['status']
-        session.add(last_workflow_execution_step)
-        session.commit()
 
-    try:
-        workflow_execution = session.query(WorkflowExecution).filter(WorkflowExecution.reana_id == reana_id).first()
-    except SQLAlchemyError as e:
-        session.rollback()
-        return
+# records started runs, given as (registry id, workflow run) tuples, and their monitor jobs in one transaction
+def record_executions(session, user, runs, batch_id=None):
+    workflow_executions = [
+        WorkflowExecution(
+            username=user.username,
+            group=user.group,
+            registry_id=registry_id,
+            batch_id=batch_id,
+            reana_id=workflow_run['workflow_id'],
+            reana_name=workflow_run['workflow_name'],
+            reana_run_number=workflow_run['run_number'],
+        ) for registry_id, workflow_run in runs
+    ]
+    session.add_all(workflow_executions)
+    session.flush()
+    # the monitor jobs are committed together with the executions, so monitoring is never lost
+    for workflow_execution in workflow_executions:
+        enqueue_job(session, 'monitor', workflow_execution.id)
+    session.commit()
+    return workflow_executions
 
-    workflow_execution.end_time = datetime.utcnow()
-    session.add(workflow_execution)
+
+# records a batch of runs, its started runs and their monitor jobs in one transaction
+def record_batch(session, user, size, runs):
+    execution_batch = ExecutionBatch(username=user.username, group=user.group, size=size)
+    session.add(execution_batch)
+    session.flush()
+    return execution_batch, record_executions(session, user, runs, execution_batch.id)
+
+
+# uploads a needed entity to the REANA workflow
+async def stage_entity(workflow, entity, source_executions):
+    if entity['type'] == 'valueFromEntity':
+        source_execution = source_executions[entity['data'].workflow_execution_id]
+        downloaded_entity = await artifact_cache.download_file(
+            reana_id=source_execution.reana_id,
+            file_name=entity['data'].path,
+            cacheable=source_execution.status == 'finished'
+        )
+        await reana.upload_file(
+            workflow=workflow,
+            file_=downloaded_entity[0],
+            file_name=entity['data'].name
+        )
+    elif entity['type'] == 'aiod-platform':
+        content_url = entity['data']['distribution'][0]['content_url']
+        await reana.upload_file_from_path(
+            workflow=workflow,
+            path=content_url[len('file://'):],
+            file_name=content_url.split('/')[-1]
+        )
+
+
+# stages the needed entities concurrently, at most STAGING_CONCURRENCY at once.
+# If a transfer fails, the remaining ones are cancelled and its exception is raised
+async def stage_entities(workflow, needed_entities, source_executions):
+    semaphore = asyncio.Semaphore(STAGING_CONCURRENCY)
+
+    async def _stage(entity):
+        async with semaphore:
+            await stage_entity(workflow, entity, source_executions)
+
+    tasks = [asyncio.ensure_future(_stage(entity)) for entity in needed_entities]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# deletes an execution (loaded by a session that was released meanwhile) with its steps, jobs and provenance in one transaction.
+# The execution row is locked first, so a capture that is writing its provenance finishes before (see write_provenance)
+def delete_execution(session, workflow_execution):
+    session.query(WorkflowExecution.id).filter(WorkflowExecution.id == workflow_execution.id).with_for_update().first()
+    delete_provenance(session, workflow_execution.id)
+    for model in (Job, WorkflowExecutionStep):
+        session.query(model).filter(model.workflow_execution_id == workflow_execution.id).delete(synchronize_session=False)
+    session.query(WorkflowExecution).filter(WorkflowExecution.id == workflow_execution.id).delete(synchronize_session=False)
     session.commit()
 
 
@@ -408,6 +650,7 @@ async def monitor_execution(reana_id):
 async def delete_workflow_execution(
     registry_id: int = None,
     reana_name: str = None,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     if registry_id and reana_name:
@@ -421,17 +664,17 @@ async def delete_workflow_execution(
     deleted_workflows_id = []
     try:
         if registry_id:
-            workflows = session.query(WorkflowExecution).filter(
+            workflows = await run_and_release(session, session.query(WorkflowExecution).filter(
                 WorkflowExecution.registry_id == registry_id,
                 WorkflowExecution.group == user.group
-            ).all()
+            ).all)
         else:
-            workflows = session.query(WorkflowExecution).filter(
+            workflows = await run_and_release(session, session.query(WorkflowExecution).filter(
                 WorkflowExecution.reana_name == reana_name,
                 WorkflowExecution.group == user.group
-            ).all()
+            ).all)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -442,17 +685,13 @@ async def delete_workflow_execution(
     for w in workflows:
         try:
             deleted_workflows_id.append(
-                client.delete_workflow(
-                    workflow=w.reana_id if registry_id else reana_name,
-                    access_token=os.environ['REANA_ACCESS_TOKEN'],
-                    all_runs=True,
-                    workspace=True
-                )['workflow_id']
+                (await reana.delete_workflow(
+                    workflow=w.reana_id if registry_id else reana_name
+                ))['workflow_id']
             )
-            session.delete(w)
-            session.commit()
+            await run_in_db(delete_execution, session, w)
         except Exception as e:
-            session.rollback()
+            await run_in_db(session.rollback)
             return Response(
                 success=False,
                 message="Problem while deleting REANA workflow: " + str(e),
@@ -478,14 +717,17 @@ async def delete_workflow_execution(
 )
 async def download_outputs(
     execution_id: int,
+    range: str = Header(None),
+    if_none_match: str = Header(None),
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow_execution = session.query(WorkflowExecution).filter(
+        workflow_execution = await run_in_db(session.query(WorkflowExecution).filter(
             WorkflowExecution.id == execution_id
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -509,23 +751,10 @@ async def download_outputs(
             data={}
         )
 
-    (output_content, file_name, is_zipped) = client.download_file(
-        workflow=workflow_execution.reana_id,
-        file_name='outputs',
-        access_token=os.environ['REANA_ACCESS_TOKEN']
-    )
-
-    def _delete_tmp_file():
-        os.unlink(temp_file.name)
-
-    with tempfile.NamedTemporaryFile(dir=os.getcwd(), delete=False) as temp_file:
-        temp_file.write(output_content)
-
-        return FileResponse(
-            temp_file.name,
-            filename='outputs.zip',
-            background=BackgroundTask(_delete_tmp_file),
-        )
+    upstream = await open_download(workflow_execution, 'outputs', 'outputs.zip', range, if_none_match)
+    if not hasattr(upstream, 'iter_content'):
+        return upstream
+    return streaming_download(upstream, download_etag(workflow_execution, 'outputs'), 'outputs.zip')
 
 
 @router.get(
@@ -534,14 +763,17 @@ async def download_outputs(
 )
 async def download_inputs(
     execution_id: int,
+    range: str = Header(None),
+    if_none_match: str = Header(None),
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow_execution = session.query(WorkflowExecution).filter(
+        workflow_execution = await run_in_db(session.query(WorkflowExecution).filter(
             WorkflowExecution.id == execution_id
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -565,27 +797,95 @@ async def download_inputs(
             data={}
         )
 
-    (input_content, file_name, _) = client.download_file(
-        workflow=workflow_execution.reana_id,
-        file_name='inputs.json',
-        access_token=os.environ['REANA_ACCESS_TOKEN']
-    )
+    upstream = await open_download(workflow_execution, 'inputs.json', 'inputs.json', range, if_none_match)
+    if not hasattr(upstream, 'iter_content'):
+        return upstream
 
-    def _delete_tmp_file():
-        os.unlink(temp_file.name)
+    etag = download_etag(workflow_execution, 'inputs.json')
+    if upstream.headers.get('Content-Length') == '2' and range is None:
+        input_content = upstream.content
+        upstream.close()
+        if input_content == b'{}':
+            return Response(
+                success=True,
+                message="Workflow does not have any input values (default were used)",
+                data={}
+            )
+        # the body has been read already, so it is sent as is
+        return HTTPResponse(
+            content=input_content,
+            status_code=upstream.status_code,
+            media_type=upstream.headers.get('Content-Type', 'application/octet-stream'),
+            headers=download_headers(upstream, etag, 'inputs.json')
+        )
+    return streaming_download(upstream, etag, 'inputs.json')
 
-    if input_content == b'{}':
+
+# files are only downloaded from finished executions, so their content never changes
+# and the ETag can be derived from the REANA workflow id and the file name
+def download_etag(workflow_execution, file_name):
+    return '"' + hashlib.sha256(f"{workflow_execution.reana_id}/{file_name}".encode('utf-8')).hexdigest() + '"'
+
+
+# starts downloading a file of an execution (from the artifact cache or REANA, forwarding the Range header).
+# returns the upstream response, or the response that must be sent instead (not modified / error)
+async def open_download(workflow_execution, file_name, download_name, range_header, if_none_match):
+    etag = download_etag(workflow_execution, file_name)
+    if if_none_match is not None and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]):
+        return HTTPResponse(status_code=304, headers={'ETag': etag})
+
+    try:
+        upstream = await artifact_cache.download_file_stream(
+            reana_id=workflow_execution.reana_id,
+            file_name=file_name,
+            download_name=download_name,
+            range_header=range_header
+        )
+    except Exception as e:
         return Response(
-            success=True,
-            message="Workflow does not have any input values (default were used)",
+            success=False,
+            message="Problem while downloading from REANA: " + str(e),
+            error_code=503,
             data={}
         )
 
-    with tempfile.NamedTemporaryFile(dir=os.getcwd(), delete=False) as temp_file:
-        temp_file.write(input_content)
-
-        return FileResponse(
-            temp_file.name,
-            filename=file_name,
-            background=BackgroundTask(_delete_tmp_file),
+    if upstream.status_code == 416:
+        upstream.close()
+        return HTTPResponse(status_code=416, headers={'Content-Range': upstream.headers.get('Content-Range', '')})
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        return Response(
+            success=False,
+            message=f"Problem while downloading from REANA: status code {upstream.status_code}",
+            error_code=503,
+            data={}
         )
+    return upstream
+
+
+# forwards the body of an upstream download to the client as it arrives
+def streaming_download(upstream, etag, filename):
+    def _body():
+        try:
+            yield from upstream.iter_content(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            upstream.close()
+
+    return StreamingResponse(
+        _body(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get('Content-Type', 'application/octet-stream'),
+        headers=download_headers(upstream, etag, filename)
+    )
+
+
+def download_headers(upstream, etag, filename):
+    headers = {
+        'ETag': etag,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Accept-Ranges': 'bytes'
+    }
+    for header in ('Content-Length', 'Content-Range'):
+        if header in upstream.headers:
+            headers[header] = upstream.headers[header]
+    return headers
@@ -1,29 +1,82 @@
 from models.response import Response
 from models.user import User
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Depends, Query
+from starlette.concurrency import run_in_threadpool
 from schema.workflow_registry import WorkflowRegistry, WorkflowRegistryModel
-from schema.init_db import session
+from schema.init_db import get_session, run_in_db
+from sqlalchemy.orm import Session, undefer
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from ruamel.yaml import YAML
+from ruamel.yaml.error import YAMLError
 from authentication.auth import authenticate_user
+from utils.pagination import keyset_paginate
+from utils.cwl import parse_spec, get_parsed_spec
 
 router = APIRouter()
 
+# fields that can be returned for a registered workflow
+WORKFLOW_FIELDS = {
+    'group': lambda w: w.group,
+    'username': lambda w: w.username,
+    'registry_id': lambda w: w.id,
+    'name': lambda w: w.name,
+    'version': lambda w: w.version,
+    'spec_file_content': get_parsed_spec,
+    'input_file_content': lambda w: w.input_file_content,
+}
+
+
+# spec/input contents are deferred, so they are only loaded when one of those fields is requested
+def content_options(fields):
+    options = []
+    if 'spec_file_content' in fields:
+        options.append(undefer(WorkflowRegistry.spec_file_parsed))
+    if 'input_file_content' in fields:
+        options.append(undefer(WorkflowRegistry.input_file_content))
+    return options
+
+
+# entries registered before spec_file_parsed existed lazy-load their spec here,
+# so this must run on the database executor
+def workflow_data(workflow, fields):
+    return {f: WORKFLOW_FIELDS[f](workflow) for f in fields}
+
 
 @router.get(
     "/",
-    description="List all workflows in the registry that belong to the same group as the authenticated user."
+    description="List all workflows in the registry that belong to the same group as the authenticated user. "
+                "Results are paginated: pass the registry_id of the last workflow received as after_id to get the next page."
 )
 async def list_workflows(
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: int = None,
+    sort: str = Query('id', pattern='^-?id$'),
+    username: str = None,
+    fields: str = Query(None, description="Comma separated list of fields to return, e.g. registry_id,name,version,username"),
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
-    yaml = YAML(typ='safe', pure=True)
+    selected_fields = fields.split(',') if fields else list(WORKFLOW_FIELDS)
+    invalid_fields = [f for f in selected_fields if f not in WORKFLOW_FIELDS]
+    if invalid_fields:
+        return Response(
+            success=False,
+            message=f"Invalid fields: {', '.join(invalid_fields)}",
+            error_code=400,
+            data={}
+        )
+
+    query = session.query(WorkflowRegistry).options(
+        *content_options(selected_fields)
+    ).filter(
+        WorkflowRegistry.group == user.group
+    )
+    if username is not None:
+        query = query.filter(WorkflowRegistry.username == username)
+    query = keyset_paginate(query, WorkflowRegistry, sort, after_id, limit)
     try:
-        workflows = session.query(WorkflowRegistry).filter(
-            WorkflowRegistry.group == user.group
-        ).all()
+        workflows = await run_in_db(query.all)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -31,17 +84,7 @@ async def list_workflows(
             data={}
         )
 
-    data = [
-        {
-            'group': user.group,
-            'username': user.username,
-            'registry_id': w.id,
-            'name': w.name,
-            'version': w.version,
-            'spec_file_content': yaml.load(w.spec_file_content),
-            'input_file_content': w.input_file_content,
-        } for w in workflows
-    ]
+    data = await run_in_db(lambda: [workflow_data(w, selected_fields) for w in workflows])
     return Response(
         success=True,
         message='Workflows successfully retrieved',
@@ -55,16 +98,18 @@ async def list_workflows(
 )
 async def get_workflow_details(
     registry_id: int,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
-    yaml = YAML(typ='safe', pure=True)
     try:
-        workflow = session.query(WorkflowRegistry).filter(
+        workflow = await run_in_db(session.query(WorkflowRegistry).options(
+            *content_options(WORKFLOW_FIELDS)
+        ).filter(
             WorkflowRegistry.id == registry_id,
             WorkflowRegistry.group == user.group
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -79,15 +124,7 @@ async def get_workflow_details(
             error_code=404,
             data={}
         )
-    data = {
-        'group': user.group,
-        'username': user.username,
-        'registry_id': workflow.id,
-        'name': workflow.name,
-        'version': workflow.version,
-        'spec_file_content': yaml.load(workflow.spec_file_content),
-        'input_file_content': workflow.input_file_content,
-    }
+    data = await run_in_db(workflow_data, workflow, WORKFLOW_FIELDS)
     return Response(
         success=True,
         message="Workflow was successfully retrieved",
@@ -104,25 +141,36 @@ async def register_workflow(
     workflow: WorkflowRegistryModel = Depends(),
     spec_file: UploadFile = File(...),
     input_file: UploadFile = File(None),
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
-    spec_file_content = spec_file.file.read()
-    input_file_content = input_file.file.read() if input_file else None
+    spec_file_content = spec_file.file.read().decode('utf-8')
+    input_file_content = input_file.file.read().decode('utf-8') if input_file else None
+    try:
+        spec_file_parsed = await run_in_threadpool(parse_spec, spec_file_content)
+    except YAMLError as e:
+        return Response(
+            success=False,
+            message=f"Invalid spec file: {str(e)}",
+            error_code=400,
+            data={}
+        )
 
     workflow = WorkflowRegistry(
         name=workflow.name,
         version=workflow.version,
         spec_file_content=spec_file_content,
+        spec_file_parsed=spec_file_parsed,
         input_file_content=input_file_content,
         username=user.username,
         group=user.group
     )
     try:
         session.add(workflow)
-        session.commit()
-        session.refresh(workflow)
+        await run_in_db(session.commit)
+        await run_in_db(session.refresh, workflow)
     except IntegrityError:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message="Integrity error. Duplicate name and version combination.",
@@ -130,26 +178,26 @@ async def register_workflow(
             data={}
         )
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
             error_code=500,
             data={}
         )
-    finally:
-        data = {
-            'username': user.username,
-            'group': user.group,
-            'registry_id': workflow.id,
-            'name': workflow.name,
-            'version': workflow.version
-        }
-        return Response(
-            success=True,
-            message="New Workflow was successfully registered",
-            data=data
-        )
+
+    data = {
+        'username': user.username,
+        'group': user.group,
+        'registry_id': workflow.id,
+        'name': workflow.name,
+        'version': workflow.version
+    }
+    return Response(
+        success=True,
+        message="New Workflow was successfully registered",
+        data=data
+    )
 
 
 @router.put(
@@ -162,15 +210,16 @@ async def update_workflow(
     version: str = None,
     spec_file: UploadFile = File(None),
     input_file: UploadFile = File(None),
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow = session.query(WorkflowRegistry).filter(
+        workflow = await run_in_db(session.query(WorkflowRegistry).filter(
             WorkflowRegistry.id == registry_id,
             WorkflowRegistry.group == user.group
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -186,21 +235,35 @@ async def update_workflow(
             data={}
         )
 
+    spec_file_content = spec_file.file.read().decode('utf-8') if spec_file else None
+    try:
+        spec_file_parsed = await run_in_threadpool(parse_spec, spec_file_content) if spec_file_content else None
+    except YAMLError as e:
+        return Response(
+            success=False,
+            message=f"Invalid spec file: {str(e)}",
+            error_code=400,
+            data={}
+        )
+
     fields_to_update = {
         k: v for k, v in {
             'name': name,
             'version': version,
-            'spec_file_content': spec_file.file.read() if spec_file else None,
-            'input_file_content': input_file.file.read() if input_file else None
+            'spec_file_content': spec_file_content,
+            'input_file_content': input_file.file.read().decode('utf-8') if input_file else None
         }.items() if v is not None}
+    if spec_file_content:
+        # NULL (parsed on read) when the new spec can't be stored as JSON
+        fields_to_update['spec_file_parsed'] = spec_file_parsed
 
     try:
-        wf_updated = session.query(WorkflowRegistry).filter(
+        wf_updated = await run_in_db(session.query(WorkflowRegistry).filter(
             WorkflowRegistry.id == registry_id,
             WorkflowRegistry.group == user.group
-        ).update(fields_to_update)
+        ).update, fields_to_update)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -215,7 +278,7 @@ async def update_workflow(
             data={}
         )
 
-    session.commit()
+    await run_in_db(session.commit)
     data = {
         'registry_id': registry_id
     }
@@ -232,15 +295,16 @@ async def update_workflow(
 )
 async def delete_workflow(
     registry_id: int,
+    session: Session = Depends(get_session),
     user: User = Depends(authenticate_user)
 ):
     try:
-        workflow = session.query(WorkflowRegistry).filter(
+        workflow = await run_in_db(session.query(WorkflowRegistry).filter(
             WorkflowRegistry.id == registry_id,
             WorkflowRegistry.group == user.group
-        ).first()
+        ).first)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
@@ -258,9 +322,9 @@ async def delete_workflow(
 
     try:
         session.delete(workflow)
-        session.commit()
+        await run_in_db(session.commit)
     except SQLAlchemyError as e:
-        session.rollback()
+        await run_in_db(session.rollback)
         return Response(
             success=False,
             message=f"Database error: {str(e)}",
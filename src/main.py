@@ -1,12 +1,19 @@
 from fastapi import FastAPI
 from schema.init_db import engine, Base
+from schema.migrate import migrate, backfill_parsed_specs
 from crud.workflow_registry import router as workflow_registry_router
 from crud.workflow_execution import router as workflow_execution_router
 from crud.prov import router as prov_router
+from crud.cache import router as cache_router
+from utils.execution_monitor import execution_monitor
+from utils.capture_worker import capture_worker
+from utils import prov_render
 
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    migrate(engine)
+    backfill_parsed_specs(engine)
 
 
 def create_routers(app):
@@ -25,6 +32,11 @@ def create_routers(app):
         prefix="/provenance",
         tags=["Provenance"]
     )
+    app.include_router(
+        cache_router,
+        prefix="/cache",
+        tags=["Cache"]
+    )
 
 
 def start_application():
@@ -34,6 +46,11 @@ def start_application():
     )
     create_tables()
     create_routers(app)
+    app.add_event_handler("startup", execution_monitor.start)
+    app.add_event_handler("shutdown", execution_monitor.stop)
+    app.add_event_handler("startup", capture_worker.start)
+    app.add_event_handler("shutdown", capture_worker.stop)
+    app.add_event_handler("shutdown", prov_render.shutdown)
     return app
 
 
@@ -0,0 +1,10 @@
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+
+# either registry_ids (one run of every workflow, with its registered inputs)
+# or registry_id with parameter_sets (one run per set, overriding the registered inputs)
+class BatchExecutionRequest(BaseModel):
+    registry_ids: List[int] = []
+    registry_id: Optional[int] = None
+    parameter_sets: List[Dict[str, Any]] = []
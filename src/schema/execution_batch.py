@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from datetime import datetime
+from .init_db import Base
+from sqlalchemy.orm import relationship
+
+
+# Executions submitted together, either of many registered workflows or of one workflow with many sets of input parameters
+class ExecutionBatch(Base):
+    __tablename__ = "execution_batch"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # number of runs requested, including the ones that could not be submitted to REANA
+    size = Column(Integer, nullable=False)
+
+    username = Column(String(255), nullable=False)
+    group = Column(String(255), nullable=False)
+
+    executions = relationship("WorkflowExecution", order_by="WorkflowExecution.id")
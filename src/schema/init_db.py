@@ -1,11 +1,66 @@
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-DATABASE_URL = f"mysql+pymysql://{os.environ['MYSQL_USER']}:{os.environ['MYSQL_PASSWORD']}@{os.environ['MYSQL_SERVER']}:3306/{os.environ['MYSQL_DATABASE']}"
+# DATABASE_URL can point to a local stand-in (e.g. sqlite) for development and testing
+DATABASE_URL = os.environ.get('DATABASE_URL') or (
+    f"mysql+pymysql://{os.environ['MYSQL_USER']}:{os.environ['MYSQL_PASSWORD']}@{os.environ['MYSQL_SERVER']}:3306/{os.environ['MYSQL_DATABASE']}"
+)
 
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
+# connection pool shared by every request and background task
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    connect_args={'check_same_thread': False} if DATABASE_URL.startswith('sqlite') else {},
+)
+# objects are not expired on commit, so reading them afterwards does not hit the database from the event loop
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
+
+# blocking database calls run on this executor so they never stall the event loop.
+# It is sized after the pool, so a worker never waits for a connection.
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('DB_EXECUTOR_WORKERS', DB_POOL_SIZE + DB_MAX_OVERFLOW)),
+    thread_name_prefix='db'
+)
+
+
+async def run_in_db(func, *args, **kwargs):
+    """Run a blocking database call (query, commit, rollback...) on the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+def get_session():
+    """FastAPI dependency that provides one session per request."""
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@contextmanager
+def session_scope():
+    """Session for code running outside of a request (e.g. background tasks)."""
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from datetime import datetime
+from .init_db import Base
+
+
+# Durable background jobs (outbox pattern).
+# Jobs are inserted in the same transaction as the change that needs them and are
+# claimed by workers with a lease, so jobs of a crashed/restarted worker are picked up again.
+class Job(Base):
+    __tablename__ = "job"
+    __table_args__ = (
+        Index('ix_job_kind_status_lease', 'kind', 'status', 'lease_expires_at'),
+        Index('ix_job_workflow_execution_kind', 'workflow_execution_id', 'kind'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(255), nullable=False)  # monitor, capture
+    status = Column(String(255), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_owner = Column(String(255), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    workflow_execution_id = Column(Integer, ForeignKey("workflow_execution.id"))
@@ -0,0 +1,64 @@
+import logging
+from ruamel.yaml.error import YAMLError
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+from utils.cwl import parse_spec
+from .init_db import Base
+from .workflow_registry import WorkflowRegistry
+
+logger = logging.getLogger(__name__)
+BACKFILL_BATCH_SIZE = 100
+
+
+# create_all only creates missing tables, it never alters the ones that already exist.
+# This brings existing tables up to date with the models by adding missing columns and indexes.
+# Columns added to an existing model must therefore be nullable (or have a server default).
+def migrate(engine):
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    preparer = engine.dialect.identifier_preparer
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}")
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+
+# workflows registered before spec_file_parsed existed get their parsed spec here, once, instead of on every read.
+# Specs that can't be stored as JSON stay NULL and keep being parsed on the fly (see utils/cwl.py get_parsed_spec)
+def backfill_parsed_specs(engine):
+    last_id = 0
+    with Session(engine) as session:
+        while True:
+            workflows = session.query(WorkflowRegistry.id, WorkflowRegistry.spec_file_content).filter(
+                WorkflowRegistry.spec_file_parsed.is_(None),
+                WorkflowRegistry.id > last_id
+            ).order_by(WorkflowRegistry.id).limit(BACKFILL_BATCH_SIZE).all()
+            if not workflows:
+                break
+
+            for registry_id, spec_file_content in workflows:
+                try:
+                    spec_file_parsed = parse_spec(spec_file_content)
+                except YAMLError as e:
+                    logger.warning(f"Could not backfill the parsed spec of workflow {registry_id}: {e}")
+                    continue
+                if spec_file_parsed is None:
+                    continue
+                session.query(WorkflowRegistry).filter(WorkflowRegistry.id == registry_id).update(
+                    {'spec_file_parsed': spec_file_parsed}, synchronize_session=False
+                )
+            session.commit()
+            last_id = workflows[-1].id
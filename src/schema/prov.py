@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Index
 from datetime import datetime
 from .init_db import Base
 from sqlalchemy.orm import relationship
@@ -6,6 +6,9 @@ from sqlalchemy.orm import relationship
 
 class Entity(Base):
     __tablename__ = 'entity'
+    __table_args__ = (
+        Index('ix_entity_workflow_execution_type', 'workflow_execution_id', 'type'),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     type = Column(Enum('workflow', 'workflow_intermediate_result_file', 'workflow_final_result_file', 'external_file'))
@@ -19,6 +22,9 @@ class Entity(Base):
 
 class Activity(Base):
     __tablename__ = 'activity'
+    __table_args__ = (
+        Index('ix_activity_workflow_execution_type', 'workflow_execution_id', 'type'),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     type = Column(Enum('workflow_execution', 'step_execution'))
@@ -50,6 +56,9 @@ class EntityGeneratedBy(Base):
 
 class Agent(Base):
     __tablename__ = 'agent'
+    __table_args__ = (
+        Index('ix_agent_workflow_execution_type', 'workflow_execution_id', 'type'),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     workflow_execution_id = Column(Integer, ForeignKey('workflow_execution.id'))
@@ -1,28 +1,39 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from datetime import datetime
 from .init_db import Base
+from sqlalchemy.orm import relationship
 
 
 class WorkflowExecution(Base):
     __tablename__ = "workflow_execution"
+    __table_args__ = (
+        Index('ix_workflow_execution_group_id', 'group', 'id'),
+        Index('ix_workflow_execution_group_start_time', 'group', 'start_time', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     start_time = Column(DateTime, default=datetime.utcnow,)
     end_time = Column(DateTime, nullable=True)
     status = Column(String(255), default="queued")
-    reana_id = Column(String(255), nullable=True)
+    reana_id = Column(String(255), nullable=True, index=True)
     reana_name = Column(String(255), nullable=True)
     reana_run_number = Column(String(255), nullable=True)
 
     registry_id = Column(Integer, ForeignKey("workflow_registry.id"))
+    batch_id = Column(Integer, ForeignKey("execution_batch.id"), nullable=True, index=True)
 
     # Add username/group here as well because user A from group G can register a workflow but user B from group G can execute it
     username = Column(String(255), nullable=False)
     group = Column(String(255), nullable=False)
 
+    steps = relationship("WorkflowExecutionStep", order_by="WorkflowExecutionStep.id")
+
 
 class WorkflowExecutionStep(Base):
     __tablename__ = "workflow_execution_step"
+    __table_args__ = (
+        Index('ix_workflow_execution_step_execution_name', 'workflow_execution_id', 'name'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
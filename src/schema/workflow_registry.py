@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Text, Index, JSON
 from sqlalchemy.dialects.mysql import LONGTEXT
 from .init_db import Base
+from sqlalchemy.orm import deferred
 from pydantic import BaseModel
 
 
@@ -14,14 +15,19 @@ class WorkflowRegistryModel(BaseModel):
 
 class WorkflowRegistry(Base):
     __tablename__ = "workflow_registry"
-    #  __table_args__ = (
-    #     UniqueConstraint('name', 'version', name='uq_name_version'),
-    #  )
+    __table_args__ = (
+        Index('ix_workflow_registry_group_id', 'group', 'id'),
+        # UniqueConstraint('name', 'version', name='uq_name_version'),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)  # PK of table
     name = Column(String(255), nullable=False)
     version = Column(String(255), nullable=False)
-    spec_file_content = Column(LONGTEXT, nullable=False)
-    input_file_content = Column(LONGTEXT, nullable=True)
+    # large columns are only loaded when accessed (or undeferred with undefer_group('content'))
+    spec_file_content = deferred(Column(Text().with_variant(LONGTEXT, 'mysql'), nullable=False), group='content')
+    input_file_content = deferred(Column(Text().with_variant(LONGTEXT, 'mysql'), nullable=True), group='content')
+    # parsed form of spec_file_content, kept in sync on register/update so reads don't parse YAML.
+    # NULL for specs that can't be stored as JSON, which are parsed on read
+    spec_file_parsed = deferred(Column(JSON(none_as_null=True), nullable=True), group='content')
     username = Column(String(255), nullable=False)
     group = Column(String(255), nullable=False)
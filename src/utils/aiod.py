@@ -0,0 +1,78 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Resolution of dataset metadata from the AIoD platform.
+# Requests share one pooled HTTP session and the datasets of a workflow are fetched concurrently.
+# Metadata is cached for Cache-Control max-age (or AIOD_METADATA_TTL) seconds and then revalidated with its ETag
+AIOD_TIMEOUT = float(os.environ.get('AIOD_TIMEOUT', 10))
+AIOD_CONCURRENCY = int(os.environ.get('AIOD_CONCURRENCY', 8))
+AIOD_METADATA_TTL = int(os.environ.get('AIOD_METADATA_TTL', 300))
+AIOD_METADATA_CACHE_SIZE = int(os.environ.get('AIOD_METADATA_CACHE_SIZE', 1024))
+
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_maxsize=AIOD_CONCURRENCY))
+session.mount('https://', HTTPAdapter(pool_maxsize=AIOD_CONCURRENCY))
+
+aiod_executor = ThreadPoolExecutor(max_workers=AIOD_CONCURRENCY, thread_name_prefix='aiod')
+
+_metadata = OrderedDict()
+_metadata_lock = threading.Lock()
+
+
+def _max_age(response):
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    if match is not None:
+        return int(match.group(1))
+    return AIOD_METADATA_TTL
+
+
+# returns the metadata of a dataset, or None if it cannot be retrieved
+def get_dataset_metadata(dataset_url):
+    url = f"{dataset_url}?schema=aiod"
+    with _metadata_lock:
+        cached = _metadata.get(url)
+        if cached is not None:
+            _metadata.move_to_end(url)
+    if cached is not None and cached['expires_at'] > time.monotonic():
+        return cached['data']
+
+    headers = {'accept': 'application/json'}
+    if cached is not None and cached['etag'] is not None:
+        headers['If-None-Match'] = cached['etag']
+    response = session.get(url, headers=headers, timeout=AIOD_TIMEOUT)
+    if response.status_code == 304 and cached is not None:
+        data = cached['data']
+    elif response.status_code == 200:
+        data = response.json()
+    else:
+        return None
+
+    with _metadata_lock:
+        _metadata[url] = {
+            'data': data,
+            'etag': response.headers.get('ETag', cached['etag'] if cached is not None else None),
+            'expires_at': time.monotonic() + _max_age(response),
+        }
+        _metadata.move_to_end(url)
+        while len(_metadata) > AIOD_METADATA_CACHE_SIZE:
+            _metadata.popitem(last=False)
+    return data
+
+
+# returns {input id: AIoD metadata} for the given {input id: dataset url}, or None if a dataset cannot be retrieved.
+# Errors while contacting the platform (e.g. timeouts) are raised
+async def resolve_platform_metadata(dataset_urls):
+    loop = asyncio.get_running_loop()
+    metadata = await asyncio.gather(
+        *(loop.run_in_executor(aiod_executor, get_dataset_metadata, dataset_url) for dataset_url in dataset_urls.values())
+    )
+    if any(data is None for data in metadata):
+        return None
+    return dict(zip(dataset_urls.keys(), metadata))
@@ -0,0 +1,347 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from utils import reana
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_CACHE_DIR = os.environ.get('ARTIFACT_CACHE_DIR', os.path.join(os.getcwd(), 'artifact_cache'))
+# maximum size (in bytes) of the cached contents
+ARTIFACT_CACHE_MAX_SIZE = int(os.environ.get('ARTIFACT_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR', os.path.join(os.getcwd(), 'render_cache'))
+RENDER_CACHE_MAX_SIZE = int(os.environ.get('RENDER_CACHE_MAX_SIZE', 256 * 1024 * 1024))
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# On-disk cache for files downloaded from REANA.
+# Files of finished executions never change, so they are cached by (reana id, path).
+# Contents are stored once per sha256 digest in blobs/ and every cached (reana id, path) refers to a blob from entries/.
+# When the stored blobs exceed max_size bytes, the least recently used entries are evicted
+class ArtifactCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # entry key -> entry, from least to most recently used. Loaded from disk on first use
+        self.entries = None
+        self.blob_references = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, reana_id, path):
+        return hashlib.sha256(f"{reana_id}/{path}".encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, 'entries', key + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, 'blobs', digest)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        for subdirectory in ('entries', 'blobs', 'tmp'):
+            os.makedirs(os.path.join(self.directory, subdirectory), exist_ok=True)
+
+        entries = []
+        for name in os.listdir(os.path.join(self.directory, 'entries')):
+            entry_path = os.path.join(self.directory, 'entries', name)
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+                entries.append((os.path.getmtime(entry_path), name[:-len('.json')], entry))
+            except (OSError, ValueError):
+                logger.warning(f"Ignoring invalid artifact cache entry {entry_path}")
+
+        # the modification time of an entry file is the last time it was used
+        self.entries = OrderedDict()
+        for _, key, entry in sorted(entries, key=lambda e: e[0]):
+            if os.path.exists(self._blob_path(entry['digest'])):
+                self._add_entry(key, entry)
+
+    def _add_entry(self, key, entry):
+        self.entries[key] = entry
+        references = self.blob_references.get(entry['digest'], 0)
+        if references == 0:
+            self.size += entry['size']
+        self.blob_references[entry['digest']] = references + 1
+
+    def _remove_entry(self, key):
+        entry = self.entries.pop(key)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+        self.blob_references[entry['digest']] -= 1
+        if self.blob_references[entry['digest']] == 0:
+            del self.blob_references[entry['digest']]
+            self.size -= entry['size']
+            try:
+                os.remove(self._blob_path(entry['digest']))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        while self.size > self.max_size and self.entries:
+            key = next(iter(self.entries))
+            self._remove_entry(key)
+            self.evictions += 1
+
+    # returns (open blob file, entry) for a cached file, or None
+    def open(self, reana_id, path):
+        key = self._key(reana_id, path)
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            f = None
+            if entry is not None:
+                try:
+                    f = open(self._blob_path(entry['digest']), 'rb')
+                except FileNotFoundError:
+                    # removed by another process sharing the cache directory
+                    self._remove_entry(key)
+            if f is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            try:
+                os.utime(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+            return f, entry
+
+    # returns a file object where content is written, which is cached by commit()
+    def create(self, reana_id, path, file_name, is_zipped):
+        with self.lock:
+            self._load()
+        return _ArtifactWriter(self, reana_id, path, file_name, is_zipped)
+
+    def _commit(self, reana_id, path, temp_path, digest, size, file_name, is_zipped):
+        key = self._key(reana_id, path)
+        entry = {
+            'reana_id': reana_id,
+            'path': path,
+            'digest': digest,
+            'size': size,
+            'file_name': file_name,
+            'is_zipped': is_zipped,
+        }
+        with self.lock:
+            if size > self.max_size:
+                os.remove(temp_path)
+                return
+            # the old entry goes first: removing it deletes its blob when nothing else refers to it,
+            # which may be the blob of this very content
+            if key in self.entries:
+                self._remove_entry(key)
+            if os.path.exists(self._blob_path(digest)):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, self._blob_path(digest))
+            with open(self._entry_path(key), 'w') as f:
+                json.dump(entry, f)
+            self._add_entry(key, entry)
+            self._evict()
+
+    def put(self, reana_id, path, content, file_name, is_zipped):
+        with self.create(reana_id, path, file_name, is_zipped) as writer:
+            writer.write(content)
+            writer.commit()
+
+    # returns the ETag (quoted content digest) of a cached file without opening it, or None
+    def etag(self, reana_id, path):
+        with self.lock:
+            self._load()
+            entry = self.entries.get(self._key(reana_id, path))
+        if entry is None:
+            return None
+        return f'"{entry["digest"]}"'
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries or {}),
+                'size': self.size,
+                'max_size': self.max_size,
+            }
+
+
+class _ArtifactWriter:
+    def __init__(self, cache, reana_id, path, file_name, is_zipped):
+        self.cache = cache
+        self.reana_id = reana_id
+        self.path = path
+        self.file_name = file_name
+        self.is_zipped = is_zipped
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.file = tempfile.NamedTemporaryFile(dir=os.path.join(cache.directory, 'tmp'), delete=False)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        temp_path = self.file.name
+        self.file.close()
+        self.file = None
+        try:
+            self.cache._commit(self.reana_id, self.path, temp_path, self.digest.hexdigest(), self.size, self.file_name, self.is_zipped)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # discards the written content if it was not committed
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.file.name)
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.abort()
+
+
+# Response-like object (same interface as a streamed requests.Response) for a file served from the cache.
+# A single byte range of the Range header is served, other ranges are ignored and the whole file is served
+class CachedResponse:
+    def __init__(self, f, entry, range_header=None):
+        self.file = f
+        self.start = 0
+        self.end = entry['size'] - 1
+        self.headers = {
+            'Content-Type': 'application/zip' if entry['is_zipped'] else 'application/octet-stream',
+            'Accept-Ranges': 'bytes',
+        }
+        self.status_code = 200
+        byte_range = parse_range(range_header, entry['size'])
+        if byte_range == 'unsatisfiable':
+            self.status_code = 416
+            self.headers['Content-Range'] = f"bytes */{entry['size']}"
+            self.end = -1
+        elif byte_range is not None:
+            self.status_code = 206
+            self.start, self.end = byte_range
+            self.headers['Content-Range'] = f"bytes {self.start}-{self.end}/{entry['size']}"
+        self.headers['Content-Length'] = str(self.end - self.start + 1)
+
+    def iter_content(self, chunk_size=1):
+        self.file.seek(self.start)
+        remaining = self.end - self.start + 1
+        while remaining > 0:
+            chunk = self.file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content(CHUNK_SIZE))
+
+    def close(self):
+        self.file.close()
+
+
+# Wraps a streamed requests.Response of a whole file, caching the body once it has been read completely
+class CachingResponse:
+    def __init__(self, response, writer):
+        self.response = response
+        self.writer = writer
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.response.iter_content(chunk_size):
+            self.writer.write(chunk)
+            yield chunk
+        self.writer.commit()
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content(CHUNK_SIZE))
+
+    def close(self):
+        self.writer.abort()
+        self.response.close()
+
+
+# returns (start, end) of a single byte range, 'unsatisfiable' or None when the whole file must be served
+def parse_range(range_header, size):
+    if range_header is None or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start, _, end = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start == '':
+            if end == '' or int(end) == 0:
+                return 'unsatisfiable'
+            return max(size - int(end), 0), size - 1
+        start = int(start)
+        end = min(int(end), size - 1) if end != '' else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return 'unsatisfiable'
+    return start, end
+
+
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_SIZE)
+# rendered provenance graphs never change either (see crud/prov.py)
+render_cache = ArtifactCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_SIZE)
+
+
+# downloads a file (see reana.download_file), served from the cache when cacheable (the execution is finished)
+async def download_file(reana_id, file_name, cacheable=True):
+    if cacheable:
+        cached = await asyncio.to_thread(artifact_cache.open, reana_id, file_name)
+        if cached is not None:
+            f, entry = cached
+            with f:
+                return await asyncio.to_thread(f.read), entry['file_name'], entry['is_zipped']
+
+    content, downloaded_file_name, is_zipped = await reana.download_file(workflow=reana_id, file_name=file_name)
+    if cacheable:
+        await asyncio.to_thread(artifact_cache.put, reana_id, file_name, content, downloaded_file_name, is_zipped)
+    return content, downloaded_file_name, is_zipped
+
+
+# starts downloading a file (see reana.download_file_stream), served from the cache when cacheable.
+# Whole files downloaded from REANA are cached once their body has been read
+async def download_file_stream(reana_id, file_name, download_name, range_header=None, cacheable=True):
+    if cacheable:
+        cached = await asyncio.to_thread(artifact_cache.open, reana_id, file_name)
+        if cached is not None:
+            return CachedResponse(*cached, range_header=range_header)
+
+    headers = {'Accept-Encoding': 'identity'}
+    if range_header is not None:
+        headers['Range'] = range_header
+    response = await reana.download_file_stream(workflow=reana_id, file_name=file_name, headers=headers)
+    if cacheable and response.status_code == 200:
+        writer = await asyncio.to_thread(
+            artifact_cache.create,
+            reana_id,
+            file_name,
+            download_name,
+            response.headers.get('Content-Type') == 'application/zip'
+        )
+        return CachingResponse(response, writer)
+    return response
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+from schema.init_db import run_in_db, session_scope
+from schema.job import Job
+from utils.jobs import JOB_LEASE_DURATION, claim_jobs, finish_job, renew_leases, retry_job
+from utils.provenance import capture_provenance
+
+logger = logging.getLogger(__name__)
+
+# maximum number of provenance captures that run at once in this worker
+CAPTURE_CONCURRENCY = int(os.environ.get('CAPTURE_CONCURRENCY', 2))
+# a capture is retried until it has failed this many times
+CAPTURE_MAX_ATTEMPTS = int(os.environ.get('CAPTURE_MAX_ATTEMPTS', 3))
+# how often (in seconds) new capture jobs are claimed and leases of running ones are renewed
+CAPTURE_CLAIM_INTERVAL = min(float(os.environ.get('CAPTURE_CLAIM_INTERVAL', 10)), JOB_LEASE_DURATION / 3)
+
+
+# Runs durable 'capture' jobs in the background.
+# Capture jobs are enqueued when an execution finishes (see execution_monitor.apply_statuses) or on request
+class CaptureWorker:
+    def __init__(self):
+        self.captures = {}
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+    # called after a capture job is enqueued, so that it is claimed right away
+    def notify(self):
+        self.wakeup.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        for task in [self.task] + list(self.captures.values()):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.task = None
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                await self.claim()
+            except Exception:
+                logger.exception("Capture worker could not claim jobs")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=CAPTURE_CLAIM_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def claim(self):
+        held_job_ids = set(await run_in_db(renew_leases, list(self.captures)))
+        # jobs whose lease expired may be running in another worker
+        for job_id in [j for j in self.captures if j not in held_job_ids]:
+            self.captures.pop(job_id).cancel()
+
+        free = CAPTURE_CONCURRENCY - len(self.captures)
+        if free > 0:
+            for job_id, execution_id in await run_in_db(claim_jobs, 'capture', free):
+                self.captures[job_id] = asyncio.create_task(self.capture(job_id, execution_id))
+
+    async def capture(self, job_id, execution_id):
+        try:
+            await capture_provenance(execution_id)
+            await run_in_db(complete_capture_job, job_id)
+            # a slot is free, the next job can be claimed right away (failed jobs are retried at the next claim)
+            self.notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Could not capture provenance of execution {execution_id}")
+            try:
+                await run_in_db(complete_capture_job, job_id, str(e))
+            except Exception:
+                logger.exception(f"Could not update capture job {job_id}")
+        finally:
+            self.captures.pop(job_id, None)
+
+
+# marks a capture job as done, or as failed once it has been attempted CAPTURE_MAX_ATTEMPTS times
+def complete_capture_job(job_id, error=None):
+    with session_scope() as session:
+        if error is None:
+            finish_job(session, job_id)
+        else:
+            attempts = session.query(Job.attempts).filter(Job.id == job_id).scalar()
+            if attempts is not None and attempts < CAPTURE_MAX_ATTEMPTS:
+                retry_job(session, job_id, error)
+            else:
+                finish_job(session, job_id, status='failed', error=error)
+        session.commit()
+
+
+capture_worker = CaptureWorker()
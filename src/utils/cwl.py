@@ -1,13 +1,39 @@
-from io import BytesIO
-import requests
-from ruamel.yaml import YAML
-
-yaml = YAML(typ='safe', pure=True)
-
-
-def add_mapping_step(spec_file):
-    data = yaml.load(spec_file)
-
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from utils import spec as spec_parser
+
+# compiled specification files are cached, keyed by the hash of the specification file and of the resolved platform metadata
+COMPILED_SPEC_CACHE_SIZE = int(os.environ.get('COMPILED_SPEC_CACHE_SIZE', 256))
+
+_compiled_specs = OrderedDict()
+_compiled_specs_lock = threading.Lock()
+
+
+# parses a specification file into the JSON compatible form stored in spec_file_parsed,
+# or None when it has values that can't be stored as JSON. Raises YAMLError for invalid files
+def parse_spec(spec_file):
+    spec = spec_parser.load(spec_file)
+    try:
+        return spec_parser.to_json(spec)
+    except ValueError:
+        return None
+
+
+# returns the parsed specification file of a registered workflow.
+# It is computed when the workflow is registered/updated, and backfilled at startup for older entries
+# (see schema/migrate.py). Specs that can't be stored as JSON are parsed on the fly
+def get_parsed_spec(workflow_registry):
+    if workflow_registry.spec_file_parsed is not None:
+        return workflow_registry.spec_file_parsed
+    return spec_parser.load(workflow_registry.spec_file_content)
+
+
+# adds a step that maps the output files of every step to their names (map.txt). Modifies data in place
+def add_mapping_step(data):
     steps_file_outputs = {}
     for s in data['steps']:
         file_ouputs = {}
@@ -67,32 +93,23 @@ def add_mapping_step(spec_file):
         data['requirements'] = {}
     data['requirements']['InlineJavascriptRequirement'] = {}
 
-    with BytesIO() as output_yaml:
-        yaml.dump(data, output_yaml)
-        return output_yaml.getvalue()
 
+# returns {input id: dataset url} for the inputs whose value comes from the AIoD platform
+def platform_inputs(spec):
+    return {i['id']: i['valueFromPlatform'].strip('{}') for i in spec['inputs'] if 'valueFromPlatform' in i.keys()}
 
-# function that replaces placeholders in the specification file.
-# returns the new specification file and the entities that need to be retrieved
-def replace_placeholders(spec_file):
+
+# function that replaces placeholders in the specification file with the resolved platform metadata.
+# Modifies spec_file_yaml in place and returns the entities that need to be retrieved
+def replace_placeholders(spec_file_yaml, metadata):
     entities = []
-    spec_file_yaml = yaml.load(spec_file)
     for i in spec_file_yaml['inputs']:
         if 'valueFromPlatform' in i.keys():
-
-            dataset_url = i['valueFromPlatform'].strip('{}')
-            url = f"{dataset_url}?schema=aiod"
-            headers = {'accept': 'application/json'}
-            response = requests.get(url, headers=headers)
-            if response.status_code != 200:
-                return None, None
-
-            data = response.json()
             entities.append(
                 {
                     'id': i['id'],
                     'type': 'aiod-platform',
-                    'data': data
+                    'data': metadata[i['id']]
                 }
             )
             del i['valueFromPlatform']  # delete it from cwl
@@ -107,6 +124,29 @@ def replace_placeholders(spec_file):
                 if i['id'] in spec_file_yaml['steps'][s]['in']:
                     spec_file_yaml['steps'][s]['requirements']['InitialWorkDirRequirement']['listing'].append(f"$(inputs.{i['id']})")
 
-    with BytesIO() as output_yaml:
-        yaml.dump(spec_file_yaml, output_yaml)
-        return output_yaml.getvalue(), entities
\ No newline at end of file
+    return entities
+
+
+# returns the specification file that is submitted to REANA (mapping step added, placeholders replaced)
+# and the entities that need to be retrieved. The parsed spec is not modified
+def compile_spec(spec_file_content, spec, metadata):
+    key = (
+        hashlib.sha256(spec_file_content.encode('utf-8')).hexdigest(),
+        hashlib.sha256(json.dumps(metadata, sort_keys=True).encode('utf-8')).hexdigest()
+    )
+    with _compiled_specs_lock:
+        compiled = _compiled_specs.get(key)
+        if compiled is not None:
+            _compiled_specs.move_to_end(key)
+            return compiled
+
+    data = copy.deepcopy(spec)
+    add_mapping_step(data)
+    entities = replace_placeholders(data, metadata)
+    compiled = (spec_parser.dump(data), entities)
+
+    with _compiled_specs_lock:
+        _compiled_specs[key] = compiled
+        while len(_compiled_specs) > COMPILED_SPEC_CACHE_SIZE:
+            _compiled_specs.popitem(last=False)
+    return compiled
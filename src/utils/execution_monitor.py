@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import or_
+from schema.init_db import run_in_db, session_scope
+from schema.job import Job
+from schema.workflow_execution import WorkflowExecution, WorkflowExecutionStep
+from utils import reana
+from utils.capture_worker import capture_worker
+from utils.jobs import JOB_LEASE_DURATION, claim_jobs, enqueue_job, finish_job, renew_leases
+
+logger = logging.getLogger(__name__)
+
+# every tracked execution is polled after MONITOR_MIN_INTERVAL seconds while it is young.
+# The interval grows by MONITOR_BACKOFF_FACTOR seconds for every second the execution has been running,
+# up to MONITOR_MAX_INTERVAL seconds
+MONITOR_MIN_INTERVAL = float(os.environ.get('MONITOR_MIN_INTERVAL', 2))
+MONITOR_MAX_INTERVAL = float(os.environ.get('MONITOR_MAX_INTERVAL', 60))
+MONITOR_BACKOFF_FACTOR = float(os.environ.get('MONITOR_BACKOFF_FACTOR', 0.1))
+# an execution is no longer tracked after this many consecutive failed status lookups
+MONITOR_MAX_ERRORS = int(os.environ.get('MONITOR_MAX_ERRORS', 10))
+# how often (in seconds) new monitor jobs are claimed and leases of tracked ones are renewed
+MONITOR_CLAIM_INTERVAL = min(float(os.environ.get('MONITOR_CLAIM_INTERVAL', 10)), JOB_LEASE_DURATION / 3)
+
+TERMINAL_STATUSES = ('finished', 'failed', 'stopped', 'deleted')
+
+
+# Single scheduler that tracks the status of every active execution in REANA.
+# Executions to track come from durable 'monitor' jobs, so monitoring survives API restarts.
+# On every tick the executions that are due are polled concurrently and
+# all resulting step/status transitions are written in a single transaction.
+class ExecutionMonitor:
+    def __init__(self):
+        self.runs = {}
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.next_claim = 0
+
+    # called after a monitor job is enqueued, so that it is claimed right away
+    def notify(self):
+        self.wakeup.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await run_in_db(resume_monitoring)
+        except Exception:
+            logger.exception("Could not resume monitoring of active executions")
+
+        while True:
+            now = loop.time()
+            if self.wakeup.is_set() or now >= self.next_claim:
+                self.wakeup.clear()
+                self.next_claim = now + MONITOR_CLAIM_INTERVAL
+                try:
+                    await self.claim()
+                except Exception:
+                    logger.exception("Execution monitor could not claim jobs")
+
+            due = [execution_id for execution_id, r in self.runs.items() if r['next_poll'] <= now]
+            if due:
+                try:
+                    await self.tick(due)
+                except Exception:
+                    logger.exception("Execution monitor tick failed")
+
+            next_wakeup = min([r['next_poll'] for r in self.runs.values()] + [self.next_claim])
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(next_wakeup - loop.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def claim(self):
+        held_job_ids = set(await run_in_db(renew_leases, [r['job_id'] for r in self.runs.values()]))
+        for execution_id in [e for e, r in self.runs.items() if r['job_id'] not in held_job_ids]:
+            del self.runs[execution_id]
+
+        now = asyncio.get_running_loop().time()
+        for job_id, execution_id, reana_id in await run_in_db(claim_monitor_jobs):
+            self.runs[execution_id] = {
+                'job_id': job_id,
+                'reana_id': reana_id,
+                'tracked_at': now,
+                'next_poll': now,
+                'errors': 0,
+            }
+
+    async def tick(self, execution_ids):
+        statuses = await asyncio.gather(
+            *(reana.get_workflow_status(workflow=self.runs[execution_id]['reana_id']) for execution_id in execution_ids),
+            return_exceptions=True
+        )
+
+        now = asyncio.get_running_loop().time()
+        polled = {}
+        for execution_id, status in zip(execution_ids, statuses):
+            r = self.runs[execution_id]
+            if isinstance(status, Exception):
+                r['errors'] += 1
+                logger.warning(f"Could not get status of REANA workflow {r['reana_id']}: {status}")
+                if r['errors'] >= MONITOR_MAX_ERRORS:
+                    del self.runs[execution_id]
+                    await run_in_db(fail_monitor_job, r['job_id'], str(status))
+                    continue
+            else:
+                r['errors'] = 0
+                polled[execution_id] = (r['job_id'], status)
+            age = now - r['tracked_at']
+            r['next_poll'] = now + min(MONITOR_MIN_INTERVAL + age * MONITOR_BACKOFF_FACTOR, MONITOR_MAX_INTERVAL)
+
+        if polled:
+            finished = await run_in_db(apply_statuses, polled)
+            for execution_id in finished:
+                self.runs.pop(execution_id, None)
+            if finished:
+                capture_worker.notify()
+
+
+# creates monitor jobs for executions that are not finished but are not monitored
+# (e.g. executions started before monitor jobs existed)
+def resume_monitoring():
+    with session_scope() as session:
+        monitored = session.query(Job.workflow_execution_id).filter(
+            Job.kind == 'monitor',
+            Job.status.in_(('pending', 'running'))
+        )
+        unmonitored_executions = session.query(WorkflowExecution.id).filter(
+            or_(WorkflowExecution.status.is_(None), WorkflowExecution.status.notin_(TERMINAL_STATUSES)),
+            WorkflowExecution.end_time.is_(None),
+            WorkflowExecution.id.notin_(monitored)
+        ).all()
+        for (execution_id,) in unmonitored_executions:
+            enqueue_job(session, 'monitor', execution_id)
+        session.commit()
+
+
+# returns a list of (job id, workflow execution id, reana id) tuples for the claimed monitor jobs
+def claim_monitor_jobs():
+    claimed = dict(claim_jobs('monitor'))
+    if not claimed:
+        return []
+    with session_scope() as session:
+        reana_ids = dict(session.query(WorkflowExecution.id, WorkflowExecution.reana_id).filter(
+            WorkflowExecution.id.in_(claimed.values())
+        ).all())
+    return [(job_id, execution_id, reana_ids[execution_id]) for job_id, execution_id in claimed.items() if execution_id in reana_ids]
+
+
+def fail_monitor_job(job_id, error):
+    with session_scope() as session:
+        finish_job(session, job_id, status='failed', error=error)
+        session.commit()
+
+
+# writes the step/status transitions of the polled executions in one transaction.
+# statuses maps every execution id to its (monitor job id, REANA status).
+# returns the ids of executions that reached a terminal status
+def apply_statuses(statuses):
+    finished = []
+    with session_scope() as session:
+        workflow_executions = session.query(WorkflowExecution).filter(
+            WorkflowExecution.id.in_(statuses.keys())
+        ).all()
+        open_steps = session.query(WorkflowExecutionStep).filter(
+            WorkflowExecutionStep.workflow_execution_id.in_(statuses.keys()),
+            WorkflowExecutionStep.end_time.is_(None)
+        ).order_by(WorkflowExecutionStep.id).all()
+        # the last step that has not ended is the one currently running
+        current_steps = {step.workflow_execution_id: step for step in open_steps}
+
+        now = datetime.utcnow()
+        for workflow_execution in workflow_executions:
+            job_id, workflow_status = statuses[workflow_execution.id]
+            status = workflow_status['status']
+            current_step_name = workflow_status['progress']['current_step_name']
+            current_step = current_steps.get(workflow_execution.id)
+
+            if current_step_name is not None and (current_step is None or current_step.name != current_step_name):
+                if current_step is not None:
+                    current_step.end_time = now
+                    current_step.status = 'finished' if status != 'failed' else 'failed'
+                current_step = WorkflowExecutionStep(
+                    name=current_step_name,
+                    workflow_execution_id=workflow_execution.id
+                )
+                session.add(current_step)
+
+            workflow_execution.status = status
+            if status in TERMINAL_STATUSES:
+                if current_step is not None:
+                    current_step.end_time = now
+                    current_step.status = status
+                workflow_execution.end_time = now
+                finish_job(session, job_id)
+                # provenance is captured in the background as soon as the execution finishes
+                if status == 'finished':
+                    enqueue_job(session, 'capture', workflow_execution.id)
+                finished.append(workflow_execution.id)
+
+        session.commit()
+
+    # executions that were deleted meanwhile are not tracked anymore
+    finished += statuses.keys() - {workflow_execution.id for workflow_execution in workflow_executions}
+    return finished
+
+
+execution_monitor = ExecutionMonitor()
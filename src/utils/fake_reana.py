@@ -0,0 +1,217 @@
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from utils import spec as spec_parser
+
+# duration (in seconds) of every step of a workflow executed by the fake REANA
+FAKE_REANA_STEP_DURATION = float(os.environ.get('FAKE_REANA_STEP_DURATION', 1))
+# latency (in seconds) added to every API call and to every file upload/download, to simulate a remote REANA
+FAKE_REANA_LATENCY = float(os.environ.get('FAKE_REANA_LATENCY', 0))
+FAKE_REANA_TRANSFER_LATENCY = float(os.environ.get('FAKE_REANA_TRANSFER_LATENCY', 0))
+
+
+def _wait(latency):
+    if latency > 0:
+        time.sleep(latency)
+
+
+# In-memory stand-in for reana_client.api.client, used for development and testing without a REANA instance.
+# It exposes the same functions (and return values) as the real client.
+# Started workflows run every step of the specification file for FAKE_REANA_STEP_DURATION seconds and then finish.
+# Calls take FAKE_REANA_LATENCY (API) or FAKE_REANA_TRANSFER_LATENCY (uploads/downloads) seconds.
+class FakeReanaClient:
+    def __init__(self):
+        self.workflows = {}
+        self.run_numbers = {}
+        self.lock = threading.Lock()
+
+    # workflows are identified by id, by name (latest run) or by name.run_number
+    def _get(self, workflow):
+        for w in reversed(list(self.workflows.values())):
+            if workflow in (w['id'], w['name'], f"{w['name']}.{w['run_number']}"):
+                return w
+        raise Exception(f"REANA workflow {workflow} does not exist")
+
+    def _add_file(self, w, file_name, content):
+        w['files'][file_name] = {
+            'content': content,
+            'last-modified': datetime.utcnow().isoformat()
+        }
+
+    def _refresh_status(self, w):
+        if w['status'] != 'running':
+            return
+        elapsed = time.monotonic() - w['started_at']
+        current = int(elapsed // FAKE_REANA_STEP_DURATION)
+        if current < len(w['steps']):
+            w['current_step'] = w['steps'][current]
+            return
+        w['status'] = 'finished'
+        w['current_step'] = w['steps'][-1] if w['steps'] else None
+        self._add_results(w)
+
+    # every File output of a step is written to cwl/<step>/ and listed in map.txt (output id,file name),
+    # as the mapping step does. Workflow outputs are copied to outputs/
+    def _add_results(self, w):
+        spec = spec_parser.load(w['files']['workflow.json']['content'])
+        file_names = {}
+        map_lines = []
+        for step_name, step in spec.get('steps', {}).items():
+            if step_name == 'map':
+                continue
+            for o in step['run'].get('outputs', []):
+                if o.get('type') == 'File':
+                    file_name = f"{step_name}_{o['id']}.out"
+                    file_names[f"{step_name}/{o['id']}"] = file_name
+                    map_lines.append(f"{o['id']},{file_name}\n")
+                    self._add_file(w, f"cwl/{step_name}/{file_name}", file_name.encode('utf-8'))
+        for o in spec.get('outputs', []):
+            if o.get('outputSource') in file_names:
+                file_name = file_names[o['outputSource']]
+                self._add_file(w, f"outputs/{file_name}", file_name.encode('utf-8'))
+        self._add_file(w, 'outputs/map.txt', ''.join(map_lines).encode('utf-8'))
+
+    def create_workflow_from_json(self, name, access_token, workflow_file=None, parameters=None, workflow_engine='cwl', **kwargs):
+        _wait(FAKE_REANA_LATENCY)
+        with open(workflow_file, 'rb') as f:
+            spec = f.read()
+        with self.lock:
+            run_number = self.run_numbers.get(name, 0) + 1
+            self.run_numbers[name] = run_number
+            w = {
+                'id': str(uuid.uuid4()),
+                'name': name,
+                'run_number': run_number,
+                'status': 'created',
+                'steps': list(spec_parser.load(spec).get('steps', {})),
+                'current_step': None,
+                'files': {},
+            }
+            self._add_file(w, 'workflow.json', spec)
+            self._add_file(w, 'inputs.json', json.dumps((parameters or {}).get('parameters', {})).encode('utf-8'))
+            self.workflows[w['id']] = w
+        return {'workflow_id': w['id'], 'workflow_name': w['name']}
+
+    def upload_file(self, workflow, file_, file_name, access_token):
+        _wait(FAKE_REANA_TRANSFER_LATENCY)
+        content = file_.read() if hasattr(file_, 'read') else file_
+        with self.lock:
+            self._add_file(self._get(workflow), file_name, content)
+        return {'message': f"{file_name} has been successfully uploaded."}
+
+    def start_workflow(self, workflow, access_token, parameters):
+        _wait(FAKE_REANA_LATENCY)
+        with self.lock:
+            w = self._get(workflow)
+            w['status'] = 'running'
+            w['started_at'] = time.monotonic()
+        return {'workflow_id': w['id'], 'workflow_name': w['name'], 'run_number': str(w['run_number']), 'status': 'running'}
+
+    def get_workflow_status(self, workflow, access_token):
+        _wait(FAKE_REANA_LATENCY)
+        with self.lock:
+            w = self._get(workflow)
+            self._refresh_status(w)
+            return {
+                'id': w['id'],
+                'name': w['name'],
+                'status': w['status'],
+                'progress': {'current_step_name': w['current_step']},
+            }
+
+    def list_files(self, workflow, access_token, **kwargs):
+        _wait(FAKE_REANA_LATENCY)
+        with self.lock:
+            w = self._get(workflow)
+            return [
+                {
+                    'name': name,
+                    'size': {'raw': len(f['content']), 'human_readable': f"{len(f['content'])} Bytes"},
+                    'last-modified': f['last-modified'],
+                } for name, f in w['files'].items()
+            ]
+
+    def download_file(self, workflow, file_name, access_token):
+        _wait(FAKE_REANA_TRANSFER_LATENCY)
+        return self._download_file(workflow, file_name)
+
+    def _download_file(self, workflow, file_name):
+        with self.lock:
+            w = self._get(workflow)
+            if file_name in w['files']:
+                return w['files'][file_name]['content'], file_name.split('/')[-1], False
+
+            # directories are downloaded as zip archives
+            prefix = file_name.rstrip('/') + '/'
+            directory_files = {name: f for name, f in w['files'].items() if name.startswith(prefix)}
+            if not directory_files:
+                raise Exception(f"Error 404 NOT FOUND {file_name} does not exist")
+            with io.BytesIO() as archive:
+                with zipfile.ZipFile(archive, 'w') as z:
+                    for name, f in directory_files.items():
+                        z.writestr(name[len(prefix):], f['content'])
+                return archive.getvalue(), f"{file_name.rstrip('/')}.zip", True
+
+    # same as the response of requests.get(..., stream=True) for the workspace file endpoint
+    def download_file_stream(self, workflow, file_name, access_token, headers=None):
+        try:
+            _wait(FAKE_REANA_TRANSFER_LATENCY)
+            content, name, is_zipped = self._download_file(workflow, file_name)
+        except Exception as e:
+            return _FakeResponse(404, {}, str(e).encode('utf-8'))
+
+        response_headers = {
+            'Content-Type': 'application/zip' if is_zipped else 'application/octet-stream',
+            'Content-Disposition': f'attachment; filename={name}',
+            'Accept-Ranges': 'bytes',
+        }
+        range_header = (headers or {}).get('Range')
+        if range_header is not None and range_header.startswith('bytes='):
+            start, _, end = range_header[len('bytes='):].partition('-')
+            if start == '':
+                start, end = max(len(content) - int(end), 0), len(content) - 1
+            else:
+                start, end = int(start), min(int(end), len(content) - 1) if end else len(content) - 1
+            if start >= len(content) or start > end:
+                response_headers['Content-Range'] = f'bytes */{len(content)}'
+                return _FakeResponse(416, response_headers, b'')
+            response_headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            response_headers['Content-Length'] = str(end - start + 1)
+            return _FakeResponse(206, response_headers, content[start:end + 1])
+
+        response_headers['Content-Length'] = str(len(content))
+        return _FakeResponse(200, response_headers, content)
+
+    def delete_workflow(self, workflow, all_runs, workspace, access_token):
+        _wait(FAKE_REANA_LATENCY)
+        with self.lock:
+            w = self._get(workflow)
+            deleted = [
+                w_id for w_id, other in self.workflows.items()
+                if (all_runs and other['name'] == w['name']) or w_id == w['id']
+            ]
+            for w_id in deleted:
+                del self.workflows[w_id]
+        return {'workflow_id': w['id'], 'workflow_name': w['name'], 'status': 'deleted'}
+
+
+class _FakeResponse:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+client = FakeReanaClient()
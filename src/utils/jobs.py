@@ -0,0 +1,77 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from schema.init_db import session_scope
+from schema.job import Job
+
+# a claimed job belongs to its worker for JOB_LEASE_DURATION seconds, the worker must renew the lease before it expires.
+# Jobs whose lease has expired (e.g. their worker crashed) can be claimed by any worker
+JOB_LEASE_DURATION = int(os.environ.get('JOB_LEASE_DURATION', 120))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# adds a new job to the session, it is persisted together with the rest of the transaction
+def enqueue_job(session, kind, workflow_execution_id):
+    job = Job(kind=kind, workflow_execution_id=workflow_execution_id)
+    session.add(job)
+    return job
+
+
+# claims pending jobs (and jobs with expired lease) of a kind.
+# returns a list of (job id, workflow execution id) tuples
+def claim_jobs(kind, limit=100):
+    with session_scope() as session:
+        now = datetime.utcnow()
+        jobs = session.query(Job).filter(
+            Job.kind == kind,
+            or_(
+                Job.status == 'pending',
+                and_(Job.status == 'running', Job.lease_expires_at < now)
+            )
+        ).order_by(Job.id).limit(limit).with_for_update(skip_locked=True).all()
+
+        for job in jobs:
+            job.status = 'running'
+            job.lease_owner = WORKER_ID
+            job.lease_expires_at = now + timedelta(seconds=JOB_LEASE_DURATION)
+            job.attempts += 1
+        session.commit()
+        return [(job.id, job.workflow_execution_id) for job in jobs]
+
+
+# extends the lease of jobs held by this worker.
+# returns the ids of the jobs that are still held (a job whose lease expired may have been claimed by another worker)
+def renew_leases(job_ids):
+    if not job_ids:
+        return []
+    with session_scope() as session:
+        held_jobs = session.query(Job).filter(
+            Job.id.in_(job_ids),
+            Job.status == 'running',
+            Job.lease_owner == WORKER_ID
+        )
+        held_jobs.update(
+            {Job.lease_expires_at: datetime.utcnow() + timedelta(seconds=JOB_LEASE_DURATION)},
+            synchronize_session=False
+        )
+        held_job_ids = [job_id for (job_id,) in held_jobs.with_entities(Job.id).all()]
+        session.commit()
+        return held_job_ids
+
+
+# marks a job as done (or failed), as part of the session's transaction
+def finish_job(session, job_id, status='done', error=None):
+    session.query(Job).filter(Job.id == job_id).update(
+        {Job.status: status, Job.error: error, Job.lease_expires_at: None},
+        synchronize_session=False
+    )
+
+
+# gives up a claimed job so that it is claimed again (e.g. after a transient error), as part of the session's transaction
+def retry_job(session, job_id, error=None):
+    session.query(Job).filter(Job.id == job_id).update(
+        {Job.status: 'pending', Job.error: error, Job.lease_owner: None, Job.lease_expires_at: None},
+        synchronize_session=False
+    )
@@ -0,0 +1,24 @@
+from sqlalchemy import and_, or_, select
+
+
+# applies keyset pagination to a query.
+# sort is a column name of the model, prefixed with '-' for descending order.
+# returned rows are the ones that come after the row with id=after_id in that order (ties are broken by id)
+def keyset_paginate(query, model, sort, after_id, limit):
+    descending = sort.startswith('-')
+    column = getattr(model, sort.lstrip('-'))
+    sort_by_id = sort.lstrip('-') == 'id'
+
+    if after_id is not None:
+        if sort_by_id:
+            query = query.filter(model.id < after_id if descending else model.id > after_id)
+        else:
+            cursor = select(column).where(model.id == after_id).scalar_subquery()
+            if descending:
+                query = query.filter(or_(column < cursor, and_(column == cursor, model.id < after_id)))
+            else:
+                query = query.filter(or_(column > cursor, and_(column == cursor, model.id > after_id)))
+
+    order_by = [model.id] if sort_by_id else [column, model.id]
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in order_by])
+    return query.limit(limit)
@@ -0,0 +1,117 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from prov.dot import prov_to_dot
+from prov.model import ProvDocument, ProvElement, ProvRelation
+
+# Rendering of provenance graphs with Graphviz.
+# prov_to_dot and Graphviz are CPU-bound, so renders run on RENDER_WORKERS worker processes
+# that receive the document serialized as PROV-JSON.
+# Every worker has its own single-process pool: a render waits for an idle worker, and only then its timeout starts.
+# A render running for longer than RENDER_TIMEOUT seconds is aborted by restarting its worker (and only its worker),
+# and graphs with more than RENDER_MAX_NODES nodes or RENDER_MAX_EDGES edges are not rendered.
+# This module is imported by the worker processes, so it must stay free of application imports
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 60))
+RENDER_MAX_NODES = int(os.environ.get('RENDER_MAX_NODES', 5000))
+RENDER_MAX_EDGES = int(os.environ.get('RENDER_MAX_EDGES', 20000))
+
+# every pool of a worker, and the queue of the idle ones
+_pools = set()
+_idle_pools = None
+_pools_lock = threading.Lock()
+
+
+class GraphTooLarge(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderUnavailable(Exception):
+    pass
+
+
+def _new_pool():
+    # workers are spawned rather than forked from the (multi-threaded) application process
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    _pools.add(pool)
+    return pool
+
+
+def _get_idle_pools():
+    global _idle_pools
+    with _pools_lock:
+        if _idle_pools is None:
+            _idle_pools = asyncio.Queue()
+            for _ in range(RENDER_WORKERS):
+                _idle_pools.put_nowait(_new_pool())
+        return _idle_pools
+
+
+# terminates the worker of a pool, e.g. one stuck in a render that timed out, and returns a new pool to replace it
+def _restart_pool(pool):
+    with _pools_lock:
+        _pools.discard(pool)
+        new_pool = _new_pool()
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+    return new_pool
+
+
+def shutdown():
+    global _idle_pools
+    with _pools_lock:
+        pools = list(_pools)
+        _pools.clear()
+        _idle_pools = None
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# runs in a worker process
+def _render(prov_json, format):
+    dot = prov_to_dot(ProvDocument.deserialize(content=prov_json, format='json'))
+    if format == 'dot':
+        return dot.to_string().encode('utf-8')
+    return dot.create(format=format)
+
+
+def _serialize(doc):
+    nodes = sum(1 for _ in doc.get_records(ProvElement))
+    edges = sum(1 for _ in doc.get_records(ProvRelation))
+    if nodes > RENDER_MAX_NODES or edges > RENDER_MAX_EDGES:
+        raise GraphTooLarge(
+            f"Provenance graph has {nodes} nodes and {edges} edges, "
+            f"at most {RENDER_MAX_NODES} nodes and {RENDER_MAX_EDGES} edges can be drawn"
+        )
+    return doc.serialize(format='json')
+
+
+# returns a PROV document rendered in the given format (png, svg or dot).
+# Raises GraphTooLarge, RenderTimeout, or RenderUnavailable when the worker process fails
+async def render_prov_document(doc, format):
+    prov_json = await asyncio.to_thread(_serialize, doc)
+    idle_pools = _get_idle_pools()
+    pool = await idle_pools.get()
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(pool, _render, prov_json, format), RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool = _restart_pool(pool)
+        raise RenderTimeout(f"Rendering took longer than {RENDER_TIMEOUT} seconds")
+    except BrokenProcessPool:
+        pool = _restart_pool(pool)
+        raise RenderUnavailable("Rendering failed, please try again")
+    except asyncio.CancelledError:
+        # nobody waits for the render anymore, the worker must not stay busy with it
+        pool = _restart_pool(pool)
+        raise
+    finally:
+        idle_pools.put_nowait(pool)
@@ -0,0 +1,427 @@
+import json
+import logging
+from prov.model import ProvDocument
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import selectinload, undefer
+from starlette.concurrency import run_in_threadpool
+from schema.init_db import run_in_db, session_scope
+from schema.prov import Entity, Activity, Agent, EntityUsedBy, EntityGeneratedBy
+from schema.workflow_execution import WorkflowExecution, WorkflowExecutionStep
+from schema.workflow_registry import WorkflowRegistry
+from utils.cwl import get_parsed_spec
+from utils import artifact_cache, prov_render, reana
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROVENANCE_MEDIA_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'dot': 'text/vnd.graphviz',
+}
+
+
+# captures the provenance of a finished execution: the files of its REANA workspace become entities,
+# the workflow and its steps become activities, linked by the wasUsedBy/wasGeneratedBy relations.
+# Executions that were deleted or already captured are skipped
+async def capture_provenance(workflow_execution_id):
+    loaded = await run_in_db(load_execution, workflow_execution_id)
+    if loaded is None:
+        return
+    workflow_execution, workflow_execution_steps, spec_file_yaml = loaded
+
+    workflow_files = await reana.list_files(
+        workflow=workflow_execution.reana_id
+    )
+    map_file_content = (await artifact_cache.download_file(
+        reana_id=workflow_execution.reana_id,
+        file_name='outputs/map.txt'
+    ))[0].decode('utf-8').split('\n')
+
+    input_file_content = json.loads(
+        (await artifact_cache.download_file(
+            reana_id=workflow_execution.reana_id,
+            file_name='inputs.json'
+        ))[0].decode('utf-8')
+    )
+
+    graph = await run_in_threadpool(
+        build_provenance,
+        workflow_execution,
+        workflow_execution_steps,
+        spec_file_yaml,
+        workflow_files,
+        map_file_content,
+        input_file_content
+    )
+    await run_in_db(write_provenance, workflow_execution_id, *graph)
+
+
+# returns (execution, its steps, its parsed specification file), or None if there is nothing to capture
+def load_execution(workflow_execution_id):
+    with session_scope() as session:
+        workflow_execution = session.query(WorkflowExecution).filter(
+            WorkflowExecution.id == workflow_execution_id
+        ).first()
+        if workflow_execution is None:
+            return None
+        if workflow_execution.status != 'finished':
+            raise Exception("Workflow must be finished in order to capture provenance")
+        if is_captured(session, workflow_execution_id):
+            return None
+
+        workflow_registry = session.query(WorkflowRegistry).options(
+            undefer(WorkflowRegistry.spec_file_parsed)
+        ).filter(WorkflowRegistry.id == workflow_execution.registry_id).first()
+        workflow_execution_steps = session.query(WorkflowExecutionStep).filter(
+            WorkflowExecutionStep.workflow_execution_id == workflow_execution_id
+        ).all()
+        return workflow_execution, workflow_execution_steps, get_parsed_spec(workflow_registry)
+
+
+def is_captured(session, workflow_execution_id):
+    return session.query(Activity.id).filter(Activity.workflow_execution_id == workflow_execution_id).first() is not None
+
+
+# loads the captured provenance graph of an execution with a constant number of queries
+# (the used/generated entities of all activities are loaded with one IN query each).
+# returns None if provenance has not been captured
+def load_provenance_graph(session, workflow_execution_id):
+    activities = session.query(Activity).options(
+        selectinload(Activity.used),
+        selectinload(Activity.generated)
+    ).filter(
+        Activity.workflow_execution_id == workflow_execution_id
+    ).order_by(Activity.id).all()
+    if not activities:
+        return None
+
+    workflow_entity = session.query(Entity).filter(
+        Entity.workflow_execution_id == workflow_execution_id,
+        Entity.type == 'workflow'
+    ).order_by(Entity.id).first()
+
+    agents = session.query(Agent).filter(
+        Agent.workflow_execution_id == workflow_execution_id
+    ).order_by(Agent.id).all()
+
+    return {
+        'activities': activities,
+        'workflow_entity': workflow_entity,
+        'workflow_activity': next(a for a in activities if a.type == 'workflow_execution'),
+        'person': next(a for a in agents if a.type == 'person'),
+        'software': next(a for a in agents if a.type == 'software'),
+    }
+
+
+# builds the W3C PROV document of a captured provenance graph (see load_provenance_graph)
+def build_prov_document(graph):
+    activities = graph['activities']
+    workflow_entity = graph['workflow_entity']
+    workflow_activity = graph['workflow_activity']
+    person = graph['person']
+    software = graph['software']
+
+    doc = ProvDocument()
+    doc.set_default_namespace('https://www.w3.org/TR/prov-dm/')
+
+    # sort activities based on end time
+    sorted_activities = sorted(activities, key=lambda x: x.end_time)
+    for i, a in enumerate(sorted_activities, start=1):
+        doc.activity(
+            a.name.replace(':', '_'),
+            a.start_time,
+            a.end_time,
+            {
+                'id': a.id,
+                'type': a.type,
+                'series': i
+            }
+        )
+
+    doc.entity(
+        workflow_entity.name,
+        {
+            'id': workflow_entity.id,
+            'type': workflow_entity.type,
+            'path': workflow_entity.path,
+            'name': workflow_entity.name,
+            'size': workflow_entity.size,
+            'last_modified': workflow_entity.last_modified,
+        }
+    )
+
+    for a in activities:
+        for entity in a.used:
+            doc.entity(
+                entity.name,
+                {
+                    'id': entity.id,
+                    'type': entity.type,
+                    'path': entity.path,
+                    'name': entity.name,
+                    'size': entity.size,
+                    'last_modified': entity.last_modified,
+                }
+            )
+
+            doc.used(a.name, entity.name)
+
+        for entity in a.generated:
+            doc.entity(
+                entity.name,
+                {
+                    'id': entity.id,
+                    'type': entity.type,
+                    'path': entity.path,
+                    'name': entity.name,
+                    'size': entity.size,
+                    'last_modified': entity.last_modified,
+                }
+            )
+            doc.generation(entity.name, a.name)
+
+    doc.start(
+        activity=sorted_activities[0].name,
+        trigger=workflow_entity.name,
+        other_attributes={
+            'time': sorted_activities[0].start_time
+        }
+    )
+
+    doc.end(
+        activity=sorted_activities[-1].name,
+        trigger=workflow_entity.name,
+        other_attributes={
+            'time': sorted_activities[-1].end_time
+        }
+    )
+
+    doc.agent(
+        person.name,
+        {
+            'type': 'person'
+        }
+    )
+
+    doc.agent(
+        software.name,
+        {
+            'type': 'software'
+        }
+    )
+
+    doc.actedOnBehalfOf(
+        delegate=software.name,
+        responsible=person.name
+    )
+    doc.attribution(
+        entity=workflow_entity.name,
+        agent=software.name
+    )
+
+    doc.association(
+        agent=software.name,
+        activity=workflow_activity.name
+    )
+
+    return doc
+
+
+# returns the provenance of an execution rendered in the given format (see PROVENANCE_MEDIA_TYPES), or None if it was not captured
+async def render_provenance(workflow_execution_id, format):
+    doc = await run_in_db(load_prov_document, workflow_execution_id)
+    if doc is None:
+        return None
+    return await prov_render.render_prov_document(doc, format)
+
+
+def load_prov_document(workflow_execution_id):
+    with session_scope() as session:
+        graph = load_provenance_graph(session, workflow_execution_id)
+        if graph is None:
+            return None
+        return build_prov_document(graph)
+
+
+# builds the provenance graph as rows of column values.
+# returns (entities, activities, agents, used, generated), used/generated are (activity, entity) pairs
+def build_provenance(workflow_execution, workflow_execution_steps, spec_file_yaml, workflow_files, map_file_content, input_file_content):
+    # filename -> entity name, from the lines "filename,entity_name" of map.txt (the first line of a filename wins)
+    entity_names = {}
+    for line in map_file_content:
+        if line:
+            filename, entity_name = line.split(',')
+            entity_names.setdefault(filename, entity_name)
+    mapped_entity_names = set(entity_names.values())
+
+    intermediate_files = [f for f in workflow_files if f['name'].startswith('cwl/') and f['name'].split('/')[-1] in mapped_entity_names]
+    output_files = [f for f in workflow_files if f['name'].startswith('outputs/') and f['name'].split('/')[-1] != 'map.txt']
+    spec_file = [f for f in workflow_files if f['name'] == 'workflow.json'][0]
+
+    classified_file_names = {f['name'] for f in intermediate_files + output_files + [spec_file]}
+    external_files = [f for f in workflow_files if f['name'] not in classified_file_names and f['name'].split('/')[-1] != 'map.txt']
+
+    # create entity for the whole workflow
+    workflow_entity = {
+        'type': 'workflow',
+        'path': f"{workflow_execution.reana_id}/workflow.json",
+        'name': 'workflow',
+        'size': spec_file['size']['human_readable'],
+        'last_modified': datetime.fromisoformat(spec_file['last-modified']),
+    }
+
+    # create entities for the intermediate files
+    intermediate_entities = [
+        {
+            'type': 'workflow_intermediate_result_file',
+            'path': i_file['name'],
+            'name': i_file['name'].split('/')[-1].replace(':', '_'),
+            'size': i_file['size']['human_readable'],
+            'last_modified': datetime.fromisoformat(i_file['last-modified']),
+        } for i_file in intermediate_files
+    ]
+
+    # create entities for the final output files
+    output_entities = [
+        {
+            'type': 'workflow_final_result_file',
+            'path': o_file['name'],
+            'name': o_file['name'].split('/')[-1].replace(':', '_'),
+            'size': o_file['size']['human_readable'],
+            'last_modified': datetime.fromisoformat(o_file['last-modified']),
+        } for o_file in output_files
+    ]
+
+    external_entities = [
+        {
+            'type': 'external_file',
+            'path': e_file['name'],
+            'name': e_file['name'].split('/')[-1].replace(':', '_'),
+            'size': e_file['size']['human_readable'],
+            'last_modified': datetime.fromisoformat(e_file['last-modified']),
+        } for e_file in external_files
+    ]
+
+    entities = [workflow_entity] + intermediate_entities + output_entities + external_entities
+
+    step_activities = [
+        {
+            'type': 'step_execution',
+            'name': s.name.replace(':', '_'),
+            'start_time': s.start_time,
+            'end_time': s.end_time,
+        } for s in workflow_execution_steps if s.name != 'map'
+    ]
+    workflow_activity = {
+        'type': 'workflow_execution',
+        'name': f"{workflow_execution.reana_name.replace(':','_')}_{workflow_execution.reana_run_number}",
+        'start_time': workflow_execution.start_time,
+        'end_time': workflow_execution.end_time,
+    }
+    activities = [workflow_activity] + step_activities
+
+    agents = [
+        {'type': 'person', 'name': workflow_execution.username},
+        {'type': 'software', 'name': 'software executing experiments'},
+    ]
+
+    # indexes used to resolve the inputs/outputs of every step (the first entity/activity with a name wins)
+    entities_by_name = {}
+    for e in entities:
+        entities_by_name.setdefault(e['name'], e)
+    external_entities_by_name = {}
+    for e in external_entities:
+        external_entities_by_name.setdefault(e['name'], e)
+    step_activities_by_name = {}
+    for a in step_activities:
+        step_activities_by_name.setdefault(a['name'], a)
+    has_platform_inputs = any('valueFromPlatform' in i for i in spec_file_yaml['inputs'])
+
+    # (activity, entity) pairs of the wasUsedBy / wasGeneratedBy relations
+    used = []
+    generated = []
+    for s in spec_file_yaml['steps']:
+        if s == 'map':  # ignore map step
+            continue
+
+        step_file_inputs = [key for key, value in spec_file_yaml['steps'][s]['run']['inputs'].items() if value == 'File']
+        step_file_outputs = [o['id'] for o in spec_file_yaml['steps'][s]['run']['outputs'] if o['type'] == 'File']
+
+        # for each input file in step (f):
+        # this file wasUsedBy the corresponding entity (entity_name) with filename=f in map.txt
+        for f in step_file_inputs:
+            # check if is external file
+            if has_platform_inputs and f in input_file_content:
+                entity = external_entities_by_name[input_file_content[f]['path']]
+            else:
+                f_in = spec_file_yaml['steps'][s]['in'][f].split('/')
+                if len(f_in) == 1:
+                    entity = entities_by_name[entity_names[f]]
+                else:
+                    entity = entities_by_name[entity_names[f_in[1]]]
+
+            used.append((step_activities_by_name[s], entity))
+
+        for f in step_file_outputs:
+            generated.append((step_activities_by_name[s], entities_by_name[entity_names[f]]))
+
+    for e in output_entities:
+        generated.append((workflow_activity, e))
+
+    return entities, activities, agents, used, generated
+
+
+# writes the provenance graph of an execution in one transaction, with one multi-row INSERT per table.
+# entities, activities and agents are dicts of column values, used/generated are (activity, entity) pairs of them.
+# Nothing is written if the execution was deleted while its provenance was being captured
+def write_provenance(workflow_execution_id, entities, activities, agents, used, generated):
+    with session_scope() as session:
+        # the execution row is locked, so the graph of an execution is never written twice
+        # and the execution can't be deleted meanwhile (see delete_execution in crud/workflow_execution.py)
+        locked = session.query(WorkflowExecution.id).filter(
+            WorkflowExecution.id == workflow_execution_id
+        ).with_for_update().first()
+        if locked is None or is_captured(session, workflow_execution_id):
+            return
+        _insert_provenance(session, workflow_execution_id, entities, activities, agents, used, generated)
+        session.commit()
+
+
+def _insert_provenance(session, workflow_execution_id, entities, activities, agents, used, generated):
+    for model, rows in ((Entity, entities), (Activity, activities), (Agent, agents)):
+        session.execute(insert(model), [dict(row, workflow_execution_id=workflow_execution_id) for row in rows])
+
+    # ids of the inserted rows (the first row with the same key wins, as for lookups by name)
+    entity_ids = {}
+    for id, type, path in session.query(Entity.id, Entity.type, Entity.path).filter(
+        Entity.workflow_execution_id == workflow_execution_id
+    ).order_by(Entity.id):
+        entity_ids.setdefault((type, path), id)
+    activity_ids = {}
+    for id, type, name in session.query(Activity.id, Activity.type, Activity.name).filter(
+        Activity.workflow_execution_id == workflow_execution_id
+    ).order_by(Activity.id):
+        activity_ids.setdefault((type, name), id)
+
+    for model, pairs in ((EntityUsedBy, used), (EntityGeneratedBy, generated)):
+        if pairs:
+            session.execute(insert(model), [
+                {
+                    'activity_id': activity_ids[(activity['type'], activity['name'])],
+                    'entity_id': entity_ids[(entity['type'], entity['path'])],
+                } for activity, entity in pairs
+            ])
+
+
+# deletes the provenance graph of an execution (association rows first, as they refer to its entities and activities),
+# as part of the session's transaction
+def delete_provenance(session, workflow_execution_id):
+    entity_ids = select(Entity.id).where(Entity.workflow_execution_id == workflow_execution_id)
+    activity_ids = select(Activity.id).where(Activity.workflow_execution_id == workflow_execution_id)
+    for model in (EntityUsedBy, EntityGeneratedBy):
+        session.query(model).filter(
+            or_(model.entity_id.in_(entity_ids), model.activity_id.in_(activity_ids))
+        ).delete(synchronize_session=False)
+    for model in (Entity, Activity, Agent):
+        session.query(model).filter(model.workflow_execution_id == workflow_execution_id).delete(synchronize_session=False)
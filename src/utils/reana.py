@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import os
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Async gateway to REANA.
+# reana_client is synchronous, so every call runs on a bounded executor with a timeout
+# and a limit on how many calls of the same kind run at once.
+# workflow arguments are REANA workflow ids (or names).
+# Setting REANA_BACKEND=fake replaces REANA with an in-memory implementation (see utils/fake_reana.py)
+if os.environ.get('REANA_BACKEND') == 'fake':
+    from utils.fake_reana import client
+else:
+    from reana_client.api import client
+
+# timeouts (in seconds) and concurrency limits for API calls and for file transfers
+REANA_API_TIMEOUT = int(os.environ.get('REANA_API_TIMEOUT', 60))
+REANA_API_CONCURRENCY = int(os.environ.get('REANA_API_CONCURRENCY', 16))
+REANA_TRANSFER_TIMEOUT = int(os.environ.get('REANA_TRANSFER_TIMEOUT', 900))
+REANA_TRANSFER_CONCURRENCY = int(os.environ.get('REANA_TRANSFER_CONCURRENCY', 4))
+
+reana_executor = ThreadPoolExecutor(
+    max_workers=REANA_API_CONCURRENCY + REANA_TRANSFER_CONCURRENCY,
+    thread_name_prefix='reana'
+)
+_api_semaphore = asyncio.Semaphore(REANA_API_CONCURRENCY)
+_transfer_semaphore = asyncio.Semaphore(REANA_TRANSFER_CONCURRENCY)
+
+
+# the permit is held until the call really finishes: on timeout wait_for stops waiting,
+# but the executor thread keeps running (and talking to REANA) until the call returns
+async def _run(func, semaphore, timeout, **kwargs):
+    await semaphore.acquire()
+    loop = asyncio.get_running_loop()
+    try:
+        future = reana_executor.submit(functools.partial(func, access_token=os.environ['REANA_ACCESS_TOKEN'], **kwargs))
+    except BaseException:
+        semaphore.release()
+        raise
+    future.add_done_callback(lambda _: _release(loop, semaphore))
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+
+
+# runs on the executor thread that finished the call
+def _release(loop, semaphore):
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # the event loop is closed, nobody is waiting for the permit anymore
+        pass
+
+
+async def _api_call(func, **kwargs):
+    return await _run(func, _api_semaphore, REANA_API_TIMEOUT, **kwargs)
+
+
+async def _transfer(func, **kwargs):
+    return await _run(func, _transfer_semaphore, REANA_TRANSFER_TIMEOUT, **kwargs)
+
+
+async def create_workflow(name, workflow_file, parameters):
+    return await _api_call(
+        client.create_workflow_from_json,
+        name=name,
+        workflow_file=workflow_file,
+        parameters=parameters,
+        workflow_engine='cwl'
+    )
+
+
+async def start_workflow(workflow):
+    return await _api_call(client.start_workflow, workflow=workflow, parameters={})
+
+
+async def get_workflow_status(workflow):
+    return await _api_call(client.get_workflow_status, workflow=workflow)
+
+
+async def list_files(workflow):
+    return await _api_call(client.list_files, workflow=workflow)
+
+
+async def delete_workflow(workflow, all_runs=True):
+    return await _api_call(client.delete_workflow, workflow=workflow, all_runs=all_runs, workspace=True)
+
+
+async def upload_file(workflow, file_, file_name):
+    return await _transfer(client.upload_file, workflow=workflow, file_=file_, file_name=file_name)
+
+
+def _upload_file_from_path(path, **kwargs):
+    # requests sends file objects in chunks, so the file is never loaded in memory as a whole
+    with open(path, 'rb') as f:
+        return client.upload_file(file_=f, **kwargs)
+
+
+async def upload_file_from_path(workflow, path, file_name):
+    return await _transfer(_upload_file_from_path, path=path, workflow=workflow, file_name=file_name)
+
+
+# returns a tuple (content, file_name, is_zipped)
+async def download_file(workflow, file_name):
+    return await _transfer(client.download_file, workflow=workflow, file_name=file_name)
+
+
+def _download_file_stream(workflow, file_name, access_token, headers=None):
+    # same endpoint reana_client.download_file uses, but the body is not read
+    return requests.get(
+        f"{os.environ['REANA_SERVER_URL'].rstrip('/')}/api/workflows/{workflow}/workspace/{file_name}",
+        params={'file_name': file_name, 'access_token': access_token},
+        headers=headers,
+        stream=True,
+        verify=False,
+        timeout=REANA_API_TIMEOUT
+    )
+
+
+# starts downloading a file and returns the response as soon as its headers arrive.
+# The body is read through response.iter_content(), response.close() must be called afterwards.
+# headers (e.g. Range) are forwarded to REANA
+async def download_file_stream(workflow, file_name, headers=None):
+    return await _transfer(
+        getattr(client, 'download_file_stream', _download_file_stream),
+        workflow=workflow,
+        file_name=file_name,
+        headers=headers
+    )
@@ -0,0 +1,87 @@
+import datetime
+import json
+import math
+import re
+import threading
+from io import BytesIO
+from ruamel.yaml import YAML
+
+# Parsing and dumping of specification files.
+# ruamel parses with its C (libyaml) implementation when ruamel.yaml.clib is installed, and with the pure Python one otherwise.
+# Specifications that are already JSON (e.g. workflow.json in REANA) are parsed with the json module.
+# Dumping always uses the pure Python emitter, so the output does not depend on the installed packages.
+# YAML instances keep the state of the document being processed, so every thread uses its own
+_local = threading.local()
+# the C loader ignores %YAML directives (it reads a %YAML 1.1 document as YAML 1.2: yes stays a string, 010 is 10)
+_YAML_DIRECTIVE = re.compile(r'^%YAML\b', re.MULTILINE)
+
+
+def _loader():
+    if not hasattr(_local, 'loader'):
+        _local.loader = YAML(typ='safe')
+    return _local.loader
+
+
+def _dumper():
+    if not hasattr(_local, 'dumper'):
+        _local.dumper = YAML(typ='safe', pure=True)
+    return _local.dumper
+
+
+def load(spec_file):
+    if hasattr(spec_file, 'read'):
+        spec_file = spec_file.read()
+    if isinstance(spec_file, bytes):
+        spec_file = spec_file.decode('utf-8')
+
+    if spec_file.lstrip()[:1] in ('{', '['):
+        try:
+            return json.loads(spec_file, object_pairs_hook=_unique_keys, parse_constant=_not_yaml_constant)
+        except ValueError:
+            # not JSON (e.g. a YAML flow mapping), or JSON the YAML loader reads differently
+            pass
+    if _YAML_DIRECTIVE.search(spec_file):
+        # a new instance, as the pure loader keeps the version of a directive for the next documents
+        return YAML(typ='safe', pure=True).load(spec_file)
+    return _loader().load(spec_file)
+
+
+# json keeps the last value of a duplicate key, the YAML loader raises DuplicateKeyError
+def _unique_keys(pairs):
+    data = dict(pairs)
+    if len(data) != len(pairs):
+        raise ValueError("Duplicate key")
+    return data
+
+
+# NaN, Infinity and -Infinity are numbers for json, but strings in YAML
+def _not_yaml_constant(constant):
+    raise ValueError(f"Unsupported constant {constant}")
+
+
+def dump(data):
+    with BytesIO() as output_yaml:
+        _dumper().dump(data, output_yaml)
+        return output_yaml.getvalue()
+
+
+# converts a parsed specification into values that can be stored in a JSON column: dates and timestamps
+# (unquoted in YAML, e.g. s:dateCreated: 2020-01-01) become ISO 8601 strings.
+# Values without a JSON equivalent (binary, sets, non-finite numbers, non-string keys) raise ValueError
+def to_json(data):
+    if isinstance(data, dict):
+        converted = {}
+        for key, value in data.items():
+            if not isinstance(key, str):
+                raise ValueError(f"Unsupported mapping key {key!r}: keys must be strings")
+            converted[key] = to_json(value)
+        return converted
+    if isinstance(data, list):
+        return [to_json(value) for value in data]
+    if isinstance(data, (datetime.date, datetime.datetime)):
+        return data.isoformat()
+    if isinstance(data, float) and not math.isfinite(data):
+        raise ValueError(f"Unsupported value {data!r}: numbers must be finite")
+    if data is None or isinstance(data, (str, int, float)):
+        return data
+    raise ValueError(f"Unsupported value of type {type(data).__name__}")
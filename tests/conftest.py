@@ -0,0 +1,152 @@
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+# The API runs against a local SQLite database and the in-memory REANA (see src/utils/fake_reana.py),
+# so tests need neither MySQL, REANA nor Keycloak
+TEST_DIR = tempfile.mkdtemp(prefix='provenance-api-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    'REANA_BACKEND': 'fake',
+    'REANA_ACCESS_TOKEN': 'test-token',
+    'REANA_SERVER_URL': 'http://reana.test',
+    'KEYCLOAK_AUTHORIZATION_URL': 'http://keycloak.test/auth',
+    'KEYCLOAK_TOKEN_URL': 'http://keycloak.test/token',
+    'KEYCLOAK_SERVER_URL': 'http://keycloak.test/',
+    'KEYCLOAK_CLIENT_ID': 'provenance-api',
+    'KEYCLOAK_REALM': 'test',
+    'KEYCLOAK_CLIENT_SECRET': '',
+    'ARTIFACT_CACHE_DIR': os.path.join(TEST_DIR, 'artifact_cache'),
+    'RENDER_CACHE_DIR': os.path.join(TEST_DIR, 'render_cache'),
+    'FAKE_REANA_STEP_DURATION': '0.2',
+    'MONITOR_MIN_INTERVAL': '0.05',
+    'MONITOR_MAX_INTERVAL': '0.2',
+    'CAPTURE_CLAIM_INTERVAL': '0.2',
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from authentication import auth  # noqa: E402
+from main import app  # noqa: E402
+from models.user import User  # noqa: E402
+from schema.init_db import Base, engine  # noqa: E402
+from utils import aiod, artifact_cache, cwl  # noqa: E402
+from utils.capture_worker import capture_worker  # noqa: E402
+from utils.execution_monitor import execution_monitor  # noqa: E402
+from utils.fake_reana import client as fake_reana  # noqa: E402
+
+USER = User(
+    id='1',
+    username='alice',
+    email='alice@example.com',
+    group='group-a',
+    first_name='Alice',
+    last_name='Liddell',
+    realm_roles=[],
+    client_roles=[]
+)
+
+SPEC = """cwlVersion: v1.2
+class: Workflow
+inputs:
+  - id: message
+    type: string
+outputs:
+  - id: output
+    type: File
+    outputSource: echo/greeting
+steps:
+  echo:
+    in:
+      message: message
+    out: [greeting]
+    run:
+      class: CommandLineTool
+      baseCommand: echo
+      inputs:
+        message: string
+      outputs:
+        - id: greeting
+          type: File
+          outputBinding:
+            glob: $(inputs.message).txt
+"""
+
+
+# SQLite only enforces foreign keys when asked to, as MySQL always does
+@event.listens_for(engine, 'connect')
+def enable_foreign_keys(connection, record):
+    connection.execute('PRAGMA foreign_keys=ON')
+
+
+# connections opened while the API was imported are replaced by ones with foreign keys on
+engine.dispose()
+
+
+@pytest.fixture(scope='session')
+def client():
+    app.dependency_overrides[auth.authenticate_user] = lambda: USER
+    with TestClient(app) as client:
+        # background workers only run in tests that use the workers fixture
+        client.portal.call(execution_monitor.stop)
+        client.portal.call(capture_worker.stop)
+        yield client
+
+
+# runs the execution monitor and the capture worker during a test
+@pytest.fixture
+def workers(client):
+    client.portal.call(execution_monitor.start)
+    client.portal.call(capture_worker.start)
+    yield
+    client.portal.call(execution_monitor.stop)
+    client.portal.call(capture_worker.stop)
+
+
+# every test starts with an empty database, REANA and caches
+@pytest.fixture(autouse=True)
+def reset():
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+
+    fake_reana.workflows.clear()
+    fake_reana.run_numbers.clear()
+    execution_monitor.runs.clear()
+    execution_monitor.next_claim = 0
+    for cache in (artifact_cache.artifact_cache, artifact_cache.render_cache):
+        shutil.rmtree(cache.directory, ignore_errors=True)
+        cache.__init__(cache.directory, cache.max_size)
+    cwl._compiled_specs.clear()
+    aiod._metadata.clear()
+    auth._verified_tokens.clear()
+    auth._public_key.update(value=None, fetched_at=0.0)
+
+
+# SQL statements sent to the database while the block runs
+@contextmanager
+def recorded_statements():
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def register_workflow(client, name='hello', version='1', spec=SPEC, input_file='message: hello\n'):
+    files = {'spec_file': ('workflow.cwl', spec)}
+    if input_file is not None:
+        files['input_file'] = ('inputs.yaml', input_file)
+    response = client.post('/workflow_registry/register/', params={'name': name, 'version': version}, files=files)
+    assert response.json()['success'], response.json()
+    return response.json()['data']['registry_id']
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from utils import aiod
+
+
+# stand-in for the AIoD platform: serves /datasets/<name> with an ETag and a Cache-Control max-age,
+# answers 304 when If-None-Match matches and records every request
+class AiodStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), AiodHandler)
+        self.datasets = {}
+        self.max_age = 60
+        self.delay = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server_port}/datasets/{name}"
+
+
+class AiodHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server
+        with stub.lock:
+            stub.requests.append((self.path, self.headers.get('If-None-Match')))
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        try:
+            time.sleep(stub.delay)
+            name = self.path.split('?')[0].split('/')[-1]
+            if name not in stub.datasets:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data = stub.datasets[name]
+            etag = f'"{hash(json.dumps(data, sort_keys=True))}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', f"max-age={stub.max_age}")
+                self.end_headers()
+                return
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f"max-age={stub.max_age}")
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = AiodStub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# replaces the clock of the metadata cache, so that tests can move it forward
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(aiod, 'time', SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_datasets_are_fetched_concurrently(stub):
+    stub.delay = 0.2
+    for i in range(6):
+        stub.datasets[f"d{i}"] = {'identifier': i}
+
+    start = time.monotonic()
+    metadata = asyncio.run(aiod.resolve_platform_metadata({f"input_{i}": stub.url(f"d{i}") for i in range(6)}))
+    elapsed = time.monotonic() - start
+
+    assert metadata == {f"input_{i}": {'identifier': i} for i in range(6)}
+    assert stub.max_in_flight == min(6, aiod.AIOD_CONCURRENCY)
+    assert elapsed < 6 * stub.delay
+
+
+def test_missing_dataset_resolves_to_none(stub):
+    stub.datasets['d0'] = {'identifier': 0}
+    assert asyncio.run(aiod.resolve_platform_metadata({'a': stub.url('d0'), 'b': stub.url('missing')})) is None
+
+
+def test_metadata_is_cached_until_max_age_expires(stub, clock):
+    stub.max_age = 60
+    stub.datasets['d0'] = {'identifier': 0}
+
+    assert aiod.get_dataset_metadata(stub.url('d0')) == {'identifier': 0}
+    clock.value += 59
+    assert aiod.get_dataset_metadata(stub.url('d0')) == {'identifier': 0}
+    assert len(stub.requests) == 1
+
+    clock.value += 2
+    assert aiod.get_dataset_metadata(stub.url('d0')) == {'identifier': 0}
+    assert len(stub.requests) == 2
+
+
+def test_expired_metadata_is_revalidated_with_its_etag(stub, clock):
+    stub.datasets['d0'] = {'identifier': 0}
+    aiod.get_dataset_metadata(stub.url('d0'))
+    etag = aiod._metadata[f"{stub.url('d0')}?schema=aiod"]['etag']
+
+    # unchanged: the platform answers 304 and the cached metadata is kept for another max-age
+    clock.value += stub.max_age + 1
+    assert aiod.get_dataset_metadata(stub.url('d0')) == {'identifier': 0}
+    assert stub.requests[-1] == ('/datasets/d0?schema=aiod', etag)
+    clock.value += stub.max_age - 1
+    aiod.get_dataset_metadata(stub.url('d0'))
+    assert len(stub.requests) == 2
+
+    # changed: the new metadata replaces the cached one
+    stub.datasets['d0'] = {'identifier': 0, 'name': 'renamed'}
+    clock.value += 2
+    assert aiod.get_dataset_metadata(stub.url('d0')) == {'identifier': 0, 'name': 'renamed'}
+    assert stub.requests[-1] == ('/datasets/d0?schema=aiod', etag)
+    assert aiod._metadata[f"{stub.url('d0')}?schema=aiod"]['etag'] != etag
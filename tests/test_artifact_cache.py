@@ -0,0 +1,45 @@
+import os
+
+from utils.artifact_cache import ArtifactCache, artifact_cache
+
+
+def read(cache, reana_id, path):
+    f, entry = cache.open(reana_id, path)
+    with f:
+        return f.read()
+
+
+def test_committing_the_same_content_twice_keeps_the_blob(tmp_path):
+    cache = ArtifactCache(str(tmp_path), 1024)
+    cache.put('workflow', 'outputs/a.txt', b'content', 'a.txt', False)
+    cache.put('workflow', 'outputs/a.txt', b'content', 'a.txt', False)
+
+    assert read(cache, 'workflow', 'outputs/a.txt') == b'content'
+    assert cache.stats()['size'] == len(b'content')
+    assert os.listdir(tmp_path / 'tmp') == []
+
+
+def test_replacing_content_removes_the_old_blob(tmp_path):
+    cache = ArtifactCache(str(tmp_path), 1024)
+    cache.put('workflow', 'outputs/a.txt', b'old', 'a.txt', False)
+    cache.put('workflow', 'outputs/b.txt', b'new', 'b.txt', False)
+    cache.put('workflow', 'outputs/a.txt', b'new', 'a.txt', False)
+
+    assert read(cache, 'workflow', 'outputs/a.txt') == b'new'
+    assert read(cache, 'workflow', 'outputs/b.txt') == b'new'
+    assert len(os.listdir(tmp_path / 'blobs')) == 1
+    assert cache.stats()['size'] == len(b'new')
+
+
+def test_cache_stats_endpoint(client):
+    artifact_cache.put('workflow', 'outputs/a.txt', b'content', 'a.txt', False)
+    read(artifact_cache, 'workflow', 'outputs/a.txt')
+    assert artifact_cache.open('workflow', 'outputs/missing.txt') is None
+
+    response = client.get('/cache/stats').json()
+
+    assert response['success'], response
+    assert response['data']['artifacts'] == {
+        'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'size': len(b'content'), 'max_size': artifact_cache.max_size
+    }
+    assert response['data']['renders']['hits'] == 0
@@ -0,0 +1,79 @@
+import asyncio
+import base64
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwt
+
+from authentication import auth
+
+
+def generate_key():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    # Keycloak publishes the base64 DER of the key, without PEM armour
+    public_der = private_key.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem, base64.b64encode(public_der).decode('ascii')
+
+
+def sign(private_key, subject):
+    claims = {'sub': subject, 'aud': 'provenance-api', 'exp': int(time.time()) + 300}
+    return jwt.encode(claims, private_key, algorithm='RS256')
+
+
+# the IdP stand-in: public_key() returns the current key and counts the fetches
+@pytest.fixture
+def idp(monkeypatch):
+    class Idp:
+        keys = [generate_key(), generate_key()]
+        current = 0
+        fetches = 0
+
+        def public_key(self):
+            self.fetches += 1
+            return self.keys[self.current][1]
+
+        def sign(self, key, subject):
+            return sign(self.keys[key][0], subject)
+
+    stand_in = Idp()
+    monkeypatch.setattr(auth.keycloak_openid, 'public_key', stand_in.public_key)
+    return stand_in
+
+
+def get_payloads(client, tokens):
+    async def run():
+        return await asyncio.gather(*(auth.get_payload(token) for token in tokens), return_exceptions=True)
+    return client.portal.call(run)
+
+
+def test_public_key_and_verified_tokens_are_cached(client, idp):
+    token = idp.sign(0, 'alice')
+    payloads = get_payloads(client, [token, token, idp.sign(0, 'bob')])
+
+    assert [p['sub'] for p in payloads] == ['alice', 'alice', 'bob']
+    assert idp.fetches == 1
+    assert len(auth._verified_tokens) == 2
+
+
+def test_key_rotation_triggers_exactly_one_refetch(client, idp, monkeypatch):
+    get_payloads(client, [idp.sign(0, 'alice')])
+    assert idp.fetches == 1
+    # the key is older than the refresh interval when the IdP rotates it
+    auth._public_key['fetched_at'] -= auth.KEYCLOAK_PUBLIC_KEY_MIN_REFRESH_INTERVAL + 1
+    idp.current = 1
+
+    payloads = get_payloads(client, [idp.sign(1, f"user-{i}") for i in range(10)])
+
+    assert [p['sub'] for p in payloads] == [f"user-{i}" for i in range(10)]
+    assert idp.fetches == 2
+
+    # a token signed with an unknown key doesn't refetch the key that was just refreshed
+    [error] = get_payloads(client, [sign(generate_key()[0], 'mallory')])
+    assert isinstance(error, HTTPException) and error.status_code == 401
+    assert idp.fetches == 2
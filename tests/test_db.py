@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from conftest import register_workflow
+from schema.init_db import engine, get_session, run_in_db, session_scope
+from schema.workflow_registry import WorkflowRegistry
+
+
+def test_slow_database_call_does_not_block_event_loop():
+    def slow_query():
+        with session_scope() as session:
+            time.sleep(0.3)
+            return session.query(WorkflowRegistry).count()
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        count = await run_in_db(slow_query)
+        ticker.cancel()
+        return count, ticks
+
+    count, ticks = asyncio.run(main())
+    assert count == 0
+    assert ticks >= 10
+
+
+def test_every_request_gets_its_own_session():
+    first, second = get_session(), get_session()
+    session_a, session_b = next(first), next(second)
+    assert session_a is not session_b
+
+    session_a.add(WorkflowRegistry(name='a', version='1', spec_file_content='{}', username='u', group='g'))
+    session_a.flush()
+    # the other request does not see (nor roll back) uncommitted state
+    assert session_b.query(WorkflowRegistry).count() == 0
+    session_b.rollback()
+    assert session_a.query(WorkflowRegistry).count() == 1
+
+    first.close()
+    second.close()
+    assert engine.pool.checkedout() == 0
+
+
+def test_registry_round_trip(client):
+    registry_id = register_workflow(client)
+
+    response = client.get(f'/workflow_registry/{registry_id}').json()
+    assert response['data']['name'] == 'hello'
+    assert response['data']['spec_file_content']['class'] == 'Workflow'
+
+    response = client.put(f'/workflow_registry/update/{registry_id}', params={'version': '2'}).json()
+    assert response['success']
+    assert [w['version'] for w in client.get('/workflow_registry/').json()['data']] == ['2']
+
+    assert client.delete(f'/workflow_registry/delete/{registry_id}').json()['success']
+    assert client.get('/workflow_registry/').json()['data'] == []
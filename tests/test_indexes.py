@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import and_, create_engine, inspect, or_
+
+from schema.init_db import engine, session_scope
+from schema.job import Job
+from schema.migrate import migrate
+from schema.prov import Activity, Agent, Entity
+from schema.workflow_execution import WorkflowExecution, WorkflowExecutionStep
+from schema.workflow_registry import WorkflowRegistry
+from utils.pagination import keyset_paginate
+
+
+# returns the SQLite query plan of a query, as one line per step
+def query_plan(query):
+    compiled = query.statement.compile(dialect=engine.dialect, compile_kwargs={'render_postcompile': True})
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", parameters).fetchall()
+    return '\n'.join(row[-1] for row in rows)
+
+
+# the hot queries of the API and the index each of them must use
+HOT_QUERIES = {
+    'registry list': (
+        lambda session: keyset_paginate(
+            session.query(WorkflowRegistry).filter(WorkflowRegistry.group == 'g'), WorkflowRegistry, 'id', None, 100
+        ),
+        'ix_workflow_registry_group_id',
+    ),
+    'execution list': (
+        lambda session: keyset_paginate(
+            session.query(WorkflowExecution).filter(WorkflowExecution.group == 'g'), WorkflowExecution, '-id', 10, 100
+        ),
+        'ix_workflow_execution_group_id',
+    ),
+    'execution list by start time': (
+        lambda session: keyset_paginate(
+            session.query(WorkflowExecution).filter(WorkflowExecution.group == 'g'), WorkflowExecution, '-start_time', None, 100
+        ),
+        'ix_workflow_execution_group_start_time',
+    ),
+    'execution by REANA id': (
+        lambda session: session.query(WorkflowExecution).filter(WorkflowExecution.reana_id == 'r'),
+        'ix_workflow_execution_reana_id',
+    ),
+    'step by execution and name': (
+        lambda session: session.query(WorkflowExecutionStep).filter(
+            WorkflowExecutionStep.workflow_execution_id == 1,
+            WorkflowExecutionStep.name == 's'
+        ),
+        'ix_workflow_execution_step_execution_name',
+    ),
+    'steps of executions': (
+        lambda session: session.query(WorkflowExecutionStep).filter(WorkflowExecutionStep.workflow_execution_id.in_([1, 2, 3])),
+        'ix_workflow_execution_step_execution_name',
+    ),
+    'activities of an execution': (
+        lambda session: session.query(Activity).filter(Activity.workflow_execution_id == 1),
+        'ix_activity_workflow_execution_type',
+    ),
+    'entities of an execution by type': (
+        lambda session: session.query(Entity).filter(Entity.workflow_execution_id == 1, Entity.type == 'workflow'),
+        'ix_entity_workflow_execution_type',
+    ),
+    'agents of an execution by type': (
+        lambda session: session.query(Agent).filter(Agent.workflow_execution_id == 1, Agent.type == 'person'),
+        'ix_agent_workflow_execution_type',
+    ),
+    'claimable jobs': (
+        lambda session: session.query(Job).filter(
+            Job.kind == 'monitor',
+            or_(Job.status == 'pending', and_(Job.status == 'running', Job.lease_expires_at < datetime.utcnow()))
+        ).order_by(Job.id).limit(100),
+        'ix_job_kind_status_lease',
+    ),
+    'jobs of an execution': (
+        lambda session: session.query(Job).filter(Job.workflow_execution_id == 1, Job.kind == 'capture'),
+        'ix_job_workflow_execution_kind',
+    ),
+}
+
+PAGINATED_QUERIES = {'registry list', 'execution list', 'execution list by start time'}
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_index(name):
+    build_query, index = HOT_QUERIES[name]
+    with session_scope() as session:
+        plan = query_plan(build_query(session))
+    assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
+    assert not any(line.startswith('SCAN') and 'INDEX' not in line for line in plan.splitlines()), plan
+    if name in PAGINATED_QUERIES:
+        # pages come out of the index already sorted
+        assert 'TEMP B-TREE' not in plan, plan
+
+
+def test_migrate_adds_missing_columns_and_indexes(tmp_path):
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old_engine.begin() as connection:
+        # workflow_execution as it was created before the indexes and batches existed
+        connection.exec_driver_sql(
+            "CREATE TABLE workflow_execution ("
+            "id INTEGER PRIMARY KEY, start_time DATETIME, end_time DATETIME, status VARCHAR(255), "
+            "reana_id VARCHAR(255), reana_name VARCHAR(255), reana_run_number VARCHAR(255), "
+            "registry_id INTEGER, username VARCHAR(255) NOT NULL, \"group\" VARCHAR(255) NOT NULL)"
+        )
+
+    migrate(old_engine)
+
+    inspector = inspect(old_engine)
+    assert 'batch_id' in {c['name'] for c in inspector.get_columns('workflow_execution')}
+    assert {i['name'] for i in inspector.get_indexes('workflow_execution')} >= {
+        'ix_workflow_execution_group_id',
+        'ix_workflow_execution_group_start_time',
+        'ix_workflow_execution_reana_id',
+        'ix_workflow_execution_batch_id',
+    }
+    # tables that did not exist are left to create_all
+    assert inspector.get_table_names() == ['workflow_execution']
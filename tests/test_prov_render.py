@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+
+from utils import prov_render
+
+
+# runs in a render worker instead of prov_render._render: the "document" is how long the render takes
+def sleeping_render(duration, format):
+    time.sleep(duration)
+    return format.encode('utf-8')
+
+
+@pytest.fixture
+def render_workers(monkeypatch):
+    def configure(workers, timeout):
+        prov_render.shutdown()
+        monkeypatch.setattr(prov_render, 'RENDER_WORKERS', workers)
+        monkeypatch.setattr(prov_render, 'RENDER_TIMEOUT', timeout)
+        monkeypatch.setattr(prov_render, '_render', sleeping_render)
+        monkeypatch.setattr(prov_render, '_serialize', lambda duration: duration)
+
+    yield configure
+    prov_render.shutdown()
+
+
+async def render(duration, delay=0):
+    await asyncio.sleep(delay)
+    try:
+        return await prov_render.render_prov_document(duration, 'dot')
+    except (prov_render.RenderTimeout, prov_render.RenderUnavailable) as e:
+        return type(e).__name__
+
+
+# spawning a worker takes a while, it must not count towards the renders of the test
+async def start_workers(workers):
+    await asyncio.gather(*(render(0) for _ in range(workers)))
+
+
+def test_time_waiting_for_a_worker_does_not_count_towards_the_timeout(render_workers):
+    render_workers(workers=1, timeout=1)
+
+    async def scenario():
+        await start_workers(1)
+        # the second render waits for the first one, so it ends after the timeout but runs for less than it
+        return await asyncio.gather(render(0.6), render(0.6))
+
+    assert asyncio.run(scenario()) == [b'dot', b'dot']
+
+
+def test_timed_out_render_does_not_abort_the_others(render_workers):
+    render_workers(workers=2, timeout=2)
+
+    async def scenario():
+        await start_workers(2)
+        # the stuck render is aborted while the other one is still running
+        return await asyncio.gather(render(30), render(1, delay=1.5))
+
+    start = time.monotonic()
+    assert asyncio.run(scenario()) == ['RenderTimeout', b'dot']
+    assert time.monotonic() - start < 10
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from conftest import USER, recorded_statements
+from schema.init_db import session_scope
+from schema.prov import Activity, Agent, Entity
+from schema.workflow_execution import WorkflowExecution
+from utils.provenance import build_prov_document, load_provenance_graph, write_provenance
+
+
+def add_execution():
+    with session_scope() as session:
+        workflow_execution = WorkflowExecution(username=USER.username, group=USER.group, reana_id='reana', status='finished')
+        session.add(workflow_execution)
+        session.commit()
+        return workflow_execution.id
+
+
+# the provenance graph of a chain of steps: every step uses the file of the previous one and generates its own
+def chain_graph(steps):
+    start = datetime(2024, 1, 1)
+    entities = [{'type': 'workflow', 'path': 'reana/workflow.json', 'name': 'workflow', 'size': '1 Bytes', 'last_modified': start}]
+    activities = [{'type': 'workflow_execution', 'name': 'hello_1', 'start_time': start, 'end_time': start + timedelta(seconds=steps)}]
+    used = []
+    generated = []
+    for i in range(steps):
+        entity = {'type': 'workflow_intermediate_result_file', 'path': f"cwl/s{i}/f{i}", 'name': f"f{i}", 'size': '1 Bytes', 'last_modified': start}
+        activity = {'type': 'step_execution', 'name': f"s{i}", 'start_time': start + timedelta(seconds=i), 'end_time': start + timedelta(seconds=i + 1)}
+        if i > 0:
+            used.append((activity, entities[-1]))
+        generated.append((activity, entity))
+        entities.append(entity)
+        activities.append(activity)
+    agents = [{'type': 'person', 'name': USER.username}, {'type': 'software', 'name': 'software executing experiments'}]
+    return entities, activities, agents, used, generated
+
+
+def add_captured_execution(steps):
+    execution_id = add_execution()
+    write_provenance(execution_id, *chain_graph(steps))
+    return execution_id
+
+
+# writes a provenance graph the way it was written before the multi-row INSERTs: one ORM object per row,
+# with the used/generated entities of every activity appended to its relationships
+def add_orm_captured_execution(steps):
+    execution_id = add_execution()
+    entities, activities, agents, used, generated = chain_graph(steps)
+    with session_scope() as session:
+        entity_rows = {e['path']: Entity(workflow_execution_id=execution_id, **e) for e in entities}
+        activity_rows = {a['name']: Activity(workflow_execution_id=execution_id, **a) for a in activities}
+        for activity, entity in used:
+            activity_rows[activity['name']].used.append(entity_rows[entity['path']])
+        for activity, entity in generated:
+            activity_rows[activity['name']].generated.append(entity_rows[entity['path']])
+        session.add_all([*entity_rows.values(), *activity_rows.values()])
+        session.add_all(Agent(workflow_execution_id=execution_id, **a) for a in agents)
+        session.commit()
+    return execution_id
+
+
+# the loaded graph of an execution, without the database ids
+def loaded_graph(execution_id):
+    def entity(e):
+        return (e.type, e.path, e.name, e.size, e.last_modified)
+
+    with session_scope() as session:
+        graph = load_provenance_graph(session, execution_id)
+        return {
+            'activities': {
+                (a.type, a.name, a.start_time, a.end_time): (sorted(map(entity, a.used)), sorted(map(entity, a.generated)))
+                for a in graph['activities']
+            },
+            'workflow_entity': entity(graph['workflow_entity']),
+            'workflow_activity': graph['workflow_activity'].name,
+            'agents': (graph['person'].name, graph['software'].name),
+        }
+
+
+def test_written_graph_loads_as_the_orm_graph():
+    written = loaded_graph(add_captured_execution(3))
+
+    assert written == loaded_graph(add_orm_captured_execution(3))
+    assert len(written['activities']) == 4
+    assert sum(len(used) + len(generated) for used, generated in written['activities'].values()) == 5
+
+
+def load_prov_document_statements(execution_id):
+    with session_scope() as session, recorded_statements() as statements:
+        doc = build_prov_document(load_provenance_graph(session, execution_id))
+    return doc, statements
+
+
+def test_load_provenance_graph_query_count_does_not_depend_on_graph_size():
+    doc, statements_small = load_prov_document_statements(add_captured_execution(2))
+    assert len(doc.get_records()) > 0
+
+    doc, statements_large = load_prov_document_statements(add_captured_execution(50))
+    assert len([r for r in doc.get_records() if r.get_type().localpart == 'Activity']) == 51
+    # activities, their used and generated entities (one IN query each), the workflow entity and the agents
+    assert len(statements_large) == len(statements_small) == 5
+
+
+def test_load_provenance_graph_of_uncaptured_execution():
+    execution_id = add_execution()
+    with session_scope() as session:
+        assert load_provenance_graph(session, execution_id) is None
+
+
+def test_provenance_of_deleted_execution_is_not_written():
+    execution_id = add_execution()
+    # deleted after its capture job was claimed
+    with session_scope() as session:
+        session.query(WorkflowExecution).filter(WorkflowExecution.id == execution_id).delete()
+        session.commit()
+
+    write_provenance(execution_id, *chain_graph(2))
+
+    with session_scope() as session:
+        assert session.query(Entity).count() == session.query(Activity).count() == session.query(Agent).count() == 0
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+from utils import reana
+
+
+def test_timed_out_call_keeps_its_permit_until_it_finishes(client, monkeypatch):
+    monkeypatch.setattr(reana, '_api_semaphore', asyncio.Semaphore(1))
+    monkeypatch.setattr(reana, 'REANA_API_TIMEOUT', 0.1)
+    finish = threading.Event()
+    calls = []
+
+    def slow_call(access_token):
+        calls.append('slow started')
+        finish.wait(5)
+        calls.append('slow finished')
+
+    def fast_call(access_token):
+        calls.append('fast')
+
+    async def scenario():
+        try:
+            await reana._api_call(slow_call)
+        except asyncio.TimeoutError:
+            calls.append('slow timed out')
+        fast = asyncio.ensure_future(reana._api_call(fast_call))
+        # the slow call still runs in its thread, so the fast one must wait for the permit
+        await asyncio.sleep(0.2)
+        assert not fast.done()
+        finish.set()
+        await fast
+
+    client.portal.call(scenario)
+    assert calls == ['slow started', 'slow timed out', 'slow finished', 'fast']
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+from ruamel.yaml import YAML
+from ruamel.yaml.constructor import DuplicateKeyError
+
+from conftest import SPEC
+from utils import spec
+
+# documents the fast paths must read exactly as the pure Python loader (the loader used before them) does
+DOCUMENTS = {
+    'yaml spec': SPEC,
+    'json spec': json.dumps(YAML(typ='safe', pure=True).load(SPEC)),
+    'yaml 1.2 scalars': "a: yes\nb: 010\nc: on\nd: 0o10\ne: 1e3\nf: ~\n",
+    'yaml 1.1 directive': "%YAML 1.1\n---\na: yes\nb: 010\nc: on\n",
+    'yaml 1.1 directive after a comment': "# workflow\n%YAML 1.1\n---\na: no\n",
+    'flow mapping': "{a: 1, b: [x, y]}",
+    'json nan': '{"a": NaN, "b": Infinity}',
+    'json escapes': '{"a": "caf\\u00e9 \\/ \\n", "b": [1.5, -2, true, null]}',
+}
+
+
+def pure_load(document):
+    return YAML(typ='safe', pure=True).load(document)
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_load_matches_pure_loader(name):
+    assert spec.load(DOCUMENTS[name]) == pure_load(DOCUMENTS[name])
+
+
+def test_yaml_directive_does_not_leak_into_next_documents():
+    spec.load(DOCUMENTS['yaml 1.1 directive'])
+    assert spec.load("a: yes\n") == {'a': 'yes'}
+
+
+@pytest.mark.parametrize('document', ['{"id": 1, "id": 2}', '[{"a": {"id": 1, "id": 2}}]', "id: 1\nid: 2\n"])
+def test_duplicate_keys_are_rejected(document):
+    with pytest.raises(DuplicateKeyError):
+        spec.load(document)
+
+
+def test_dump_round_trip():
+    data = spec.load(SPEC)
+    assert spec.load(spec.dump(data)) == data
@@ -0,0 +1,335 @@
+import time
+from datetime import datetime, timedelta
+
+from conftest import USER, recorded_statements, register_workflow
+from schema.execution_batch import ExecutionBatch
+from schema.init_db import engine, session_scope
+from schema.job import Job
+from schema.prov import Activity, Agent, Entity, EntityGeneratedBy, EntityUsedBy
+from schema.workflow_execution import WorkflowExecution, WorkflowExecutionStep
+from utils import jobs
+from utils.execution_monitor import execution_monitor
+from utils.fake_reana import client as fake_reana
+from utils.provenance import is_captured
+
+
+# records the number of database connections in use whenever REANA is called
+def record_connections_during_reana_calls(monkeypatch):
+    connections = []
+    for name in ('create_workflow_from_json', 'start_workflow'):
+        call = getattr(fake_reana, name)
+
+        def recording_call(*args, _call=call, **kwargs):
+            connections.append(engine.pool.checkedout())
+            return _call(*args, **kwargs)
+
+        monkeypatch.setattr(fake_reana, name, recording_call)
+    return connections
+
+
+def test_execute_releases_connection_during_reana_calls(client, monkeypatch):
+    registry_id = register_workflow(client)
+    connections = record_connections_during_reana_calls(monkeypatch)
+
+    response = client.post(f'/workflow_execution/execute/{registry_id}').json()
+
+    assert response['success'], response
+    assert connections == [0, 0]
+    assert engine.pool.checkedout() == 0
+
+
+def test_batch_releases_connection_during_reana_calls(client, monkeypatch):
+    registry_id = register_workflow(client)
+    connections = record_connections_during_reana_calls(monkeypatch)
+
+    response = client.post('/workflow_execution/batch', json={
+        'registry_id': registry_id,
+        'parameter_sets': [{'message': 'a'}, {'message': 'b'}, {'message': 'c'}],
+    }).json()
+
+    assert response['success'], response
+    assert len(response['data']['executions']) == 3
+    assert connections == [0] * 6
+    assert engine.pool.checkedout() == 0
+
+
+def add_executions(count, steps=3):
+    with session_scope() as session:
+        first = session.query(WorkflowExecution).count()
+        for i in range(first, first + count):
+            workflow_execution = WorkflowExecution(
+                username=USER.username, group=USER.group, reana_id=f"reana-{i}", reana_name='hello', reana_run_number=str(i)
+            )
+            session.add(workflow_execution)
+            session.flush()
+            session.add_all(WorkflowExecutionStep(name=f"step-{s}", workflow_execution_id=workflow_execution.id) for s in range(steps))
+        session.commit()
+
+
+def list_statements(client, **params):
+    with recorded_statements() as statements:
+        response = client.get('/workflow_execution/', params=params).json()
+    return response, statements
+
+
+def test_list_executions_query_count_does_not_depend_on_executions(client):
+    add_executions(1)
+    response, statements_one = list_statements(client)
+    assert len(response['data']) == 1
+
+    add_executions(50)
+    response, statements_many = list_statements(client)
+    assert len(response['data']) == 51
+    assert all(len(execution['steps']) == 3 for execution in response['data'].values())
+    # executions, then the steps of all of them with one IN query
+    assert len(statements_many) == len(statements_one) == 2
+
+    response, statements = list_statements(client, include_steps=False)
+    assert 'steps' not in next(iter(response['data'].values()))
+    assert len(statements) == 1
+
+
+# executions of two batches, alternating: some of them failed, and start times are shared by pairs of executions
+def batch_status(client, batch_id):
+    response = client.get(f'/workflow_execution/batch/{batch_id}').json()
+    assert response['success'], response
+    return response['data']
+
+
+def test_batch_reaches_finished(client, workers):
+    registry_id = register_workflow(client)
+    response = client.post('/workflow_execution/batch', json={
+        'registry_id': registry_id,
+        'parameter_sets': [{'message': 'a'}, {'message': 'b'}],
+    }).json()
+    assert response['success'], response
+    batch_id = response['data']['batch_id']
+    execution_ids = [execution['execution_id'] for execution in response['data']['executions']]
+
+    batch = batch_status(client, batch_id)
+    assert (batch['size'], batch['status']) == (2, 'running')
+    assert [execution['execution_id'] for execution in batch['executions']] == execution_ids
+
+    wait_for(lambda: batch_status(client, batch_id)['status'] == 'finished')
+    batch = batch_status(client, batch_id)
+    assert batch['status_counts'] == {'finished': 2}
+    assert all(execution['end_time'] is not None for execution in batch['executions'])
+    assert client.get(f'/workflow_execution/batch/{batch_id + 1}').json()['error_code'] == 404
+
+
+def add_batch_executions(count):
+    with session_scope() as session:
+        batches = [ExecutionBatch(size=count, username=USER.username, group=USER.group) for _ in range(2)]
+        session.add_all(batches)
+        session.flush()
+        start = datetime(2024, 1, 1)
+        session.add_all(
+            WorkflowExecution(
+                username=USER.username, group=USER.group, reana_id=f"reana-batch-{i}", reana_name='batch', reana_run_number=str(i),
+                batch_id=batches[i % 2].id, status='failed' if i % 5 == 0 else 'finished', start_time=start + timedelta(minutes=i // 4)
+            ) for i in range(count)
+        )
+        session.commit()
+        return [batch.id for batch in batches]
+
+
+def list_pages(client, limit, **params):
+    pages = []
+    while True:
+        cursor = {'after_id': pages[-1][-1]} if pages else {}
+        data = client.get('/workflow_execution/', params={**params, **cursor, 'limit': limit}).json()['data']
+        if not data:
+            return pages
+        assert len(data) <= limit
+        pages.append([execution['execution_id'] for execution in data.values()])
+
+
+def test_list_executions_pages_with_filters(client):
+    add_executions(3)
+    batch_id, _ = add_batch_executions(20)
+    with session_scope() as session:
+        executions = session.query(WorkflowExecution).filter(
+            WorkflowExecution.batch_id == batch_id, WorkflowExecution.status == 'finished'
+        ).all()
+        by_id = [e.id for e in sorted(executions, key=lambda e: e.id)]
+        by_start_time = [e.id for e in sorted(executions, key=lambda e: (e.start_time, e.id), reverse=True)]
+
+    for sort, expected in (('id', by_id), ('-start_time', by_start_time)):
+        pages = list_pages(client, 3, sort=sort, batch_id=batch_id, status='finished', include_steps=False)
+        assert len(pages) == -(-len(expected) // 3)
+        # pages don't overlap and, together, hold every matching execution in order
+        assert [execution_id for page in pages for execution_id in page] == expected, sort
+
+
+def test_delete_removes_executions_and_their_jobs(client, monkeypatch):
+    registry_id = register_workflow(client)
+    client.post(f'/workflow_execution/execute/{registry_id}')
+    connections = []
+    delete_workflow = fake_reana.delete_workflow
+
+    def recording_delete(*args, **kwargs):
+        connections.append(engine.pool.checkedout())
+        return delete_workflow(*args, **kwargs)
+
+    monkeypatch.setattr(fake_reana, 'delete_workflow', recording_delete)
+
+    response = client.delete('/workflow_execution/delete/', params={'registry_id': registry_id}).json()
+
+    assert response['success'], response
+    assert len(response['data']) == 1
+    assert connections == [0]
+    with session_scope() as session:
+        assert session.query(WorkflowExecution).count() == 0
+        assert session.query(Job).count() == 0
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def execution_status(execution_id):
+    with session_scope() as session:
+        return session.query(WorkflowExecution.status).filter(WorkflowExecution.id == execution_id).scalar()
+
+
+def test_monitoring_resumes_after_a_crash(client, workers, monkeypatch):
+    registry_id = register_workflow(client)
+    execution_id = client.post(f'/workflow_execution/execute/{registry_id}').json()['data']['execution_id']
+    wait_for(lambda: execution_id in execution_monitor.runs)
+
+    # the API process dies: the monitor stops without finishing its job, and its in-memory state is lost
+    client.portal.call(execution_monitor.stop)
+    execution_monitor.runs.clear()
+    execution_monitor.next_claim = 0
+    with session_scope() as session:
+        job = session.query(Job).filter(Job.workflow_execution_id == execution_id, Job.kind == 'monitor').one()
+        assert (job.status, job.lease_owner) == ('running', jobs.WORKER_ID)
+        # the lease runs out while the API is down
+        job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        session.commit()
+    assert execution_status(execution_id) != 'finished'
+
+    # a new process takes over, while the workflow keeps running in REANA
+    monkeypatch.setattr(jobs, 'WORKER_ID', 'restarted-worker')
+    client.portal.call(execution_monitor.start)
+
+    wait_for(lambda: execution_status(execution_id) == 'finished')
+    with session_scope() as session:
+        job = session.query(Job).filter(Job.workflow_execution_id == execution_id, Job.kind == 'monitor').one()
+        assert (job.status, job.lease_owner, job.attempts) == ('done', 'restarted-worker', 2)
+        steps = session.query(WorkflowExecutionStep).filter(WorkflowExecutionStep.workflow_execution_id == execution_id).all()
+    assert steps and all(step.end_time is not None for step in steps)
+
+
+def is_captured_execution(execution_id):
+    with session_scope() as session:
+        return is_captured(session, execution_id)
+
+
+def test_delete_removes_captured_provenance(client, workers):
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA foreign_keys').scalar() == 1
+    registry_id = register_workflow(client)
+    execution_id = client.post(f'/workflow_execution/execute/{registry_id}').json()['data']['execution_id']
+    wait_for(lambda: is_captured_execution(execution_id))
+
+    response = client.delete('/workflow_execution/delete/', params={'registry_id': registry_id}).json()
+
+    assert response['success'], response
+    with session_scope() as session:
+        for model in (WorkflowExecution, WorkflowExecutionStep, Job, Entity, Activity, Agent, EntityUsedBy, EntityGeneratedBy):
+            assert session.query(model).count() == 0, model.__name__
+
+
+# a finished execution whose REANA workspace holds the given files
+def add_finished_execution(files):
+    w = {'id': f"reana-{len(fake_reana.workflows)}", 'name': 'finished', 'run_number': 1, 'status': 'finished', 'steps': [], 'current_step': None, 'files': {}}
+    for name, content in files.items():
+        fake_reana._add_file(w, name, content)
+    fake_reana.workflows[w['id']] = w
+    with session_scope() as session:
+        workflow_execution = WorkflowExecution(
+            username=USER.username, group=USER.group, reana_id=w['id'], reana_name='finished', reana_run_number='1', status='finished'
+        )
+        session.add(workflow_execution)
+        session.commit()
+        return workflow_execution.id
+
+
+def test_download_two_byte_inputs(client):
+    execution_id = add_finished_execution({'inputs.json': b'[]'})
+
+    # from REANA, then from the artifact cache
+    for _ in range(2):
+        response = client.get(f'/workflow_execution/inputs/{execution_id}')
+        assert response.status_code == 200
+        assert response.content == b'[]'
+        assert response.headers['ETag']
+
+    execution_id = add_finished_execution({'inputs.json': b'{}'})
+    response = client.get(f'/workflow_execution/inputs/{execution_id}').json()
+    assert response['success'] and response['data'] == {}
+
+
+def test_download_outputs(client):
+    execution_id = add_finished_execution({'outputs/a.txt': b'a' * 100, 'outputs/b.txt': b'b' * 100})
+    with session_scope() as session:
+        reana_id = session.query(WorkflowExecution.reana_id).filter(WorkflowExecution.id == execution_id).scalar()
+    content = fake_reana._download_file(reana_id, 'outputs')[0]
+    url = f'/workflow_execution/outputs/{execution_id}'
+
+    # a range from REANA, the whole file from REANA (which caches it), then a range from the cache
+    for range_header in ('bytes=10-19', None, 'bytes=-5'):
+        response = client.get(url, headers={'Range': range_header} if range_header else {})
+        if range_header is None:
+            assert response.status_code == 200
+            assert response.content == content
+            assert response.headers['Content-Length'] == str(len(content))
+        else:
+            start, end = (10, 19) if range_header == 'bytes=10-19' else (len(content) - 5, len(content) - 1)
+            assert response.status_code == 206
+            assert response.content == content[start:end + 1]
+            assert response.headers['Content-Range'] == f"bytes {start}-{end}/{len(content)}"
+        assert response.headers['Content-Type'] == 'application/zip'
+        assert response.headers['Content-Disposition'] == 'attachment; filename="outputs.zip"'
+        assert response.headers['Accept-Ranges'] == 'bytes'
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={'Range': f"bytes={len(content)}-"})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{len(content)}"
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.content == b''
+
+
+def test_download_inputs(client):
+    inputs = b'{"message": "hello"}'
+    execution_id = add_finished_execution({'inputs.json': inputs})
+    url = f'/workflow_execution/inputs/{execution_id}'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == inputs
+    assert response.headers['Content-Disposition'] == 'attachment; filename="inputs.json"'
+
+    response = client.get(url, headers={'Range': 'bytes=2-8'})
+    assert response.status_code == 206
+    assert response.content == inputs[2:9]
+    assert response.headers['Content-Range'] == f"bytes 2-8/{len(inputs)}"
+
+    assert client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_download_of_unfinished_execution(client):
+    add_executions(1)
+    with session_scope() as session:
+        execution_id = session.query(WorkflowExecution.id).scalar()
+    for kind in ('outputs', 'inputs'):
+        response = client.get(f'/workflow_execution/{kind}/{execution_id}').json()
+        assert response['error_code'] == 409
@@ -0,0 +1,107 @@
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from conftest import SPEC, recorded_statements, register_workflow
+from schema.init_db import engine, session_scope
+from schema.migrate import backfill_parsed_specs
+from schema.workflow_registry import WorkflowRegistry
+
+DATED_SPEC = SPEC + "s:dateCreated: 2020-01-01\n"
+
+
+def test_register_and_update_spec_with_unquoted_date(client):
+    registry_id = register_workflow(client, spec=DATED_SPEC)
+    assert registry_id is not None
+
+    workflow = client.get(f'/workflow_registry/{registry_id}').json()['data']
+    assert workflow['spec_file_content']['s:dateCreated'] == '2020-01-01'
+
+    response = client.put(
+        f'/workflow_registry/update/{registry_id}', files={'spec_file': ('workflow.cwl', SPEC + "s:dateCreated: 2021-02-03\n")}
+    ).json()
+    assert response['success'], response
+    workflow = client.get(f'/workflow_registry/{registry_id}').json()['data']
+    assert workflow['spec_file_content']['s:dateCreated'] == '2021-02-03'
+
+
+def stored_parsed_spec(registry_id):
+    with session_scope() as session:
+        return session.query(WorkflowRegistry.spec_file_parsed).filter(WorkflowRegistry.id == registry_id).scalar()
+
+
+def test_spec_that_cannot_be_stored_as_json_is_parsed_on_read(client):
+    registry_id = register_workflow(client, spec=SPEC + "1: one\n")
+    assert stored_parsed_spec(registry_id) is None
+    workflow = client.get(f'/workflow_registry/{registry_id}').json()['data']
+    assert workflow['spec_file_content']['1'] == 'one'
+
+    # updating to such a spec doesn't keep the parsed form of the previous one
+    registry_id = register_workflow(client, version='2')
+    assert stored_parsed_spec(registry_id) is not None
+    response = client.put(
+        f'/workflow_registry/update/{registry_id}', files={'spec_file': ('workflow.cwl', SPEC + "data: !!binary aGVsbG8=\n")}
+    ).json()
+    assert response['success'], response
+    assert stored_parsed_spec(registry_id) is None
+    workflow = client.get(f'/workflow_registry/{registry_id}').json()['data']
+    assert workflow['spec_file_content']['data'] == 'hello'
+
+
+def test_register_rejects_invalid_yaml(client):
+    response = client.post(
+        '/workflow_registry/register/', params={'name': 'hello', 'version': '1'}, files={'spec_file': ('workflow.cwl', 'a: [b\n')}
+    ).json()
+    assert not response['success']
+    assert response['error_code'] == 400
+    with session_scope() as session:
+        assert session.query(WorkflowRegistry).count() == 0
+
+
+def test_list_loads_only_the_selected_fields(client):
+    for version in ('1', '2'):
+        register_workflow(client, version=version)
+
+    with recorded_statements() as statements:
+        response = client.get('/workflow_registry/', params={'fields': 'registry_id,name,version'}).json()
+
+    assert response['success'], response
+    assert [set(workflow) for workflow in response['data']] == [{'registry_id', 'name', 'version'}] * 2
+    # the deferred contents are neither in the listing query nor lazy-loaded afterwards
+    assert len(statements) == 1
+    for column in ('spec_file_content', 'spec_file_parsed', 'input_file_content'):
+        assert column not in statements[0]
+
+    with recorded_statements() as statements:
+        response = client.get('/workflow_registry/', params={'fields': 'registry_id,spec_file_content'}).json()
+    assert all(workflow['spec_file_content']['class'] == 'Workflow' for workflow in response['data'])
+    assert len(statements) == 1
+    assert 'spec_file_parsed' in statements[0] and 'input_file_content' not in statements[0]
+
+
+def test_register_reports_database_errors(client, monkeypatch):
+    def failing_commit(self):
+        raise OperationalError('INSERT INTO workflow_registry', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(Session, 'commit', failing_commit)
+    response = client.post(
+        '/workflow_registry/register/', params={'name': 'hello', 'version': '2'}, files={'spec_file': ('workflow.cwl', SPEC)}
+    ).json()
+    assert not response['success']
+    assert response['error_code'] == 500
+
+
+def test_backfill_parsed_specs(client):
+    with session_scope() as session:
+        session.add_all([
+            WorkflowRegistry(name='old', version='1', spec_file_content=DATED_SPEC, username='alice', group='group-a'),
+            WorkflowRegistry(name='old', version='2', spec_file_content=SPEC + "data: !!binary aGVsbG8=\n", username='alice', group='group-a'),
+        ])
+        session.commit()
+
+    backfill_parsed_specs(engine)
+
+    with session_scope() as session:
+        parsed = dict(session.query(WorkflowRegistry.version, WorkflowRegistry.spec_file_parsed))
+    assert parsed['1']['s:dateCreated'] == '2020-01-01'
+    # can't be stored as JSON, so it keeps being parsed on read
+    assert parsed['2'] is None